@@ -0,0 +1,4 @@
+"""
+Benchmarks of `bulk_update` against `save()` and Django's own
+`QuerySet.bulk_update`, run with `python -m benchmarks`.
+"""
@@ -0,0 +1,105 @@
+"""
+Run the benchmarks against the tests' database (``DATABASE_URL``, an
+in-memory SQLite database by default) and print the results:
+
+    python -m benchmarks --rows 1000 10000 --fields 1 5 --format json
+    python -m benchmarks --methods bulk_update --strategies case values
+
+With ``--baseline``, exit with status 1 if some result is slower than the
+same one in the baseline results by more than ``--threshold`` times.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+
+def batch_size(value):
+    return None if value.lower() == 'none' else int(value)
+
+
+def get_parser():
+    from django_bulk_update.helper import STRATEGIES
+    from .suite import CASES, METHODS
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES),
+                        help='default: all the cases the database supports')
+    parser.add_argument('--methods', nargs='+', choices=list(METHODS),
+                        help='default: all the available methods')
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGIES,
+                        default=['case'],
+                        help="of bulk_update, the database's ones only")
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000])
+    parser.add_argument('--fields', nargs='+', type=int, default=[1, 5],
+                        help='numbers of updated fields')
+    parser.add_argument('--batch-sizes', nargs='+', type=batch_size,
+                        default=[None], help="'none' for the default")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--output', help='default: stdout')
+    parser.add_argument('--baseline',
+                        help='JSON results to compare the results with')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    return parser
+
+
+def write(results, output, output_format):
+    if output_format == 'json':
+        json.dump(results, output, indent=2)
+        output.write('\n')
+        return
+
+    writer = csv.writer(output)
+    if results:
+        writer.writerow(list(results[0]))
+    for result in results:
+        writer.writerow([
+            ' '.join(map(str, value)) if isinstance(value, list) else value
+            for value in result.values()
+        ])
+
+
+def main(argv=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from . import suite
+
+    args = get_parser().parse_args(argv)
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = list(suite.run(
+            cases=args.cases, rows=args.rows, widths=args.fields,
+            batch_sizes=args.batch_sizes, methods=args.methods,
+            repeat=args.repeat, strategies=args.strategies,
+        ))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            write(results, output, args.format)
+    else:
+        write(results, sys.stdout, args.format)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            slower = suite.regressions(
+                results, json.load(baseline), args.threshold)
+        for result, base in slower:
+            sys.stderr.write('{}: {:.4f}s, was {:.4f}s\n'.format(
+                ' '.join(map(str, suite.result_key(result))),
+                result['seconds'], base['seconds']))
+        return 1 if slower else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Micro-benchmark of the parameters and case clauses assembly of a wide
+batch, against the previous implementation (which flattened a [pk, value]
+list per object and field), in time and peak memory:
+
+    python -m benchmarks.parameters --objs 10000 --fields 20
+
+It doesn't need any database, only Django set up with the tests' models.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+from collections import OrderedDict, defaultdict
+
+
+class Batch(object):
+
+    def __init__(self, n_objs=10000, n_fields=20):
+        from django_bulk_update import helper
+        from tests.models import Person
+
+        self.helper = helper
+        self.n_objs = n_objs
+        self.plan = helper.get_plan(Person._meta)
+        self.fields = self.plan.fields[:n_fields]
+        self.pks = list(range(n_objs))
+        self.columns = [list(range(n_objs)) for _ in self.fields]
+        self.placeholders = [None] * len(self.fields)
+
+    def legacy(self):
+        helper = self.helper
+        parameters = defaultdict(list)
+        placeholders = defaultdict(list)
+        for idx, pk_value in enumerate(self.pks):
+            for column, field in zip(self.columns, self.fields):
+                parameters[field].extend(
+                    helper.flatten([pk_value, column[idx]], types=tuple))
+                placeholders[field].append('%s')
+
+        case_template = "WHEN %s THEN {} "
+        values = ', '.join(
+            (case_template * len(placeholders[field])).format(
+                *placeholders[field]).join(self.plan._case_template(field))
+            for field in parameters.keys()
+        )
+        parameters = helper.flatten(parameters.values(), types=list)
+        parameters.extend(self.pks)
+        return values, parameters
+
+    def builder(self):
+        values = ', '.join(
+            self.plan.case_sql(field, self.n_objs, field_placeholders)
+            for field, field_placeholders in zip(self.fields,
+                                                 self.placeholders)
+        )
+        parameters = self.helper._case_parameters(
+            self.pks, self.columns, self.placeholders)
+        return values, parameters
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def peak_memory(function):
+    import tracemalloc
+
+    function()  # warm the plan's cache
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(n_objs=10000, n_fields=20, repeat=3):
+    """
+    Return the best time and, on python 3.4+, the peak memory of both
+    implementations.
+    """
+    batch = Batch(n_objs, n_fields)
+    result = OrderedDict([('objs', n_objs), ('fields', len(batch.fields))])
+    for name in ('legacy', 'builder'):
+        function = getattr(batch, name)
+        result[name + '_seconds'] = best_time(function, repeat)
+        if sys.version_info >= (3, 4):
+            result[name + '_peak_bytes'] = peak_memory(function)
+    return result
+
+
+def main(argv=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+    import django
+    django.setup()
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.parameters')
+    parser.add_argument('--objs', type=int, default=10000)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    json.dump(run(args.objs, args.fields, args.repeat), sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
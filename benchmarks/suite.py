@@ -0,0 +1,219 @@
+"""
+The benchmark cases and methods, and the loop timing every combination of
+them. Django has to be set up, with the tests' models and database.
+"""
+import itertools
+import platform
+import timeit
+
+from collections import OrderedDict
+from datetime import date, time, timedelta
+from decimal import Decimal
+
+import django
+from django.db import connection, models
+from django.utils import timezone
+
+from django_bulk_update import helper
+from tests.fixtures import create_fixtures
+from tests.models import Brand, Person, PersonUUID
+
+# Person fields updated by the 'person' case, the first ones for narrow
+# updates.
+PERSON_FIELDS = [
+    'age', 'name', 'height', 'float_height', 'certified', 'date', 'text',
+    'email', 'big_age', 'small_age', 'positive_age', 'slug', 'url', 'time',
+    'date_time', 'null_certified', 'positive_small_age', 'file_path',
+]
+
+
+def _create_people(n):
+    create_fixtures(n)
+
+
+def _create_people_uuid(n):
+    PersonUUID.objects.bulk_create(PersonUUID(age=idx) for idx in range(n))
+
+
+def _create_brands(n):
+    Brand.objects.bulk_create(Brand(name=str(idx)) for idx in range(n))
+
+
+# name: (model, create n rows, fields, vendors or None for all of them)
+CASES = OrderedDict([
+    ('person', (Person, _create_people, PERSON_FIELDS, None)),
+    ('json', (Person, _create_people, ['data'], None)),
+    ('uuid', (PersonUUID, _create_people_uuid, ['age'], None)),
+    ('array', (Brand, _create_brands, ['codes'], ('postgresql',))),
+])
+
+
+def new_value(field, idx, run):
+    """
+    Return a value of `field` for the `idx`-th object, different for every
+    `run`.
+    """
+    seed = idx + run
+    if isinstance(field, models.BooleanField):
+        return seed % 2 == 0
+    if isinstance(field, models.IntegerField):
+        return seed % 100
+    if isinstance(field, models.DecimalField):
+        return Decimal('1.{:02d}'.format(seed % 100))
+    if isinstance(field, models.FloatField):
+        return float(seed)
+    if isinstance(field, models.DateTimeField):
+        return timezone.now()
+    if isinstance(field, models.DateField):
+        return date(2015, 1, 1) + timedelta(days=seed % 365)
+    if isinstance(field, models.TimeField):
+        return time(seed % 24)
+    if field.get_internal_type() == 'ArrayField':
+        return ['code_{}'.format(seed)]
+    if isinstance(field, (models.CharField, models.TextField,
+                          models.FilePathField)):
+        return '{}-{}'.format(field.name, seed)
+    # JSON
+    return {'idx': idx, 'run': run}
+
+
+def change(objs, fields, run):
+    for idx, obj in enumerate(objs):
+        for field in fields:
+            setattr(obj, field.attname, new_value(field, idx, run))
+
+
+def bulk_update(model, objs, field_names, batch_size, strategy):
+    helper.bulk_update(objs, update_fields=field_names, batch_size=batch_size,
+                       strategy=strategy)
+
+
+def save(model, objs, field_names, batch_size, strategy):
+    for obj in objs:
+        obj.save(update_fields=field_names)
+
+
+def django_bulk_update(model, objs, field_names, batch_size, strategy):
+    # BulkUpdateManager's querysets override it
+    models.QuerySet.bulk_update(
+        model.objects.all(), objs, field_names, batch_size=batch_size)
+
+
+# name: update function, the methods other than bulk_update ignore the
+# strategy
+METHODS = OrderedDict([
+    ('bulk_update', bulk_update),
+    ('save', save),
+    ('django', django_bulk_update),
+])
+
+
+def available_methods():
+    # QuerySet.bulk_update is new in Django 2.2
+    return [
+        name for name in METHODS
+        if name != 'django' or hasattr(models.QuerySet, 'bulk_update')
+    ]
+
+
+def available_strategies(strategies):
+    return [
+        strategy for strategy in strategies
+        if helper.STRATEGY_VENDORS.get(
+            strategy, connection.vendor) == connection.vendor
+    ]
+
+
+def environment():
+    return OrderedDict([
+        ('vendor', connection.vendor),
+        ('django', django.get_version()),
+        ('python', platform.python_version()),
+    ])
+
+
+def run(cases=None, rows=(1000,), widths=(1, 5), batch_sizes=(None,),
+        methods=None, repeat=3, strategies=('case',)):
+    """
+    Time every combination of the arguments, and yield one result per
+    combination, as an ordered dict, with the best of `repeat` times.
+
+    Cases and strategies not supported by the database are skipped, as
+    well as widths larger than the fields of a case. `strategies` only
+    apply to the 'bulk_update' method, whose results have a None one.
+    """
+    env = environment()
+    methods = methods or available_methods()
+    strategies = available_strategies(strategies)
+
+    for case in cases or list(CASES):
+        model, create, case_fields, vendors = CASES[case]
+        if vendors is not None and connection.vendor not in vendors:
+            continue
+
+        case_widths = sorted(set(
+            min(width, len(case_fields)) for width in widths))
+
+        for n_rows in rows:
+            model.objects.all().delete()
+            create(n_rows)
+            objs = list(model.objects.all())
+
+            combinations = [
+                (width, batch_size, method, strategy)
+                for width, batch_size, method in itertools.product(
+                    case_widths, batch_sizes, methods)
+                for strategy in (
+                    strategies if method == 'bulk_update' else [None])
+            ]
+            for width, batch_size, method, strategy in combinations:
+                field_names = case_fields[:width]
+                fields = [
+                    model._meta.get_field(name) for name in field_names]
+                update = METHODS[method]
+
+                times = []
+                for run_idx in range(repeat):
+                    change(objs, fields, run_idx)
+                    start = timeit.default_timer()
+                    update(model, objs, field_names, batch_size, strategy)
+                    times.append(timeit.default_timer() - start)
+
+                result = OrderedDict(env)
+                result.update([
+                    ('case', case),
+                    ('method', method),
+                    ('strategy', strategy),
+                    ('rows', n_rows),
+                    ('fields', width),
+                    ('batch_size', batch_size),
+                    ('seconds', min(times)),
+                    ('times', times),
+                ])
+                yield result
+
+        model.objects.all().delete()
+
+
+def result_key(result):
+    # results from before strategies were timed are the default one's
+    strategy = result.get(
+        'strategy', 'case' if result['method'] == 'bulk_update' else None)
+    return (
+        result['vendor'], result['case'], result['method'], strategy,
+        result['rows'], result['fields'], result['batch_size'],
+    )
+
+
+def regressions(results, baseline, threshold):
+    """
+    Return the `(result, baseline result)` pairs where the result is
+    slower than the matching baseline one by more than `threshold` times.
+    """
+    baseline = dict((result_key(result), result) for result in baseline)
+    return [
+        (result, baseline[result_key(result)])
+        for result in results
+        if result_key(result) in baseline and
+        result['seconds'] > baseline[result_key(result)]['seconds'] * threshold
+    ]
@@ -0,0 +1,99 @@
+"""
+Asynchronous bulk_update, for python 3.5+.
+"""
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+from . import helper
+
+
+async def abulk_update(objs, meta=None, update_fields=None,
+                       exclude_fields=None, using='default', batch_size=None,
+                       pk_field='pk', strategy='case', max_query_params=None,
+                       only_changed=False, returning=None, version_field=None,
+                       queryset=None, sort_pks=False, prepare=False,
+                       pad_batches=False):
+    """
+    Same as `helper.bulk_update`, without blocking the event loop.
+
+    The database is only accessed from two threads: one prepares the SQL
+    of the next batch while the other executes the current one, and the
+    event loop is free in between.
+    """
+    if strategy == 'copy':
+        raise ValueError("The 'copy' strategy isn't supported asynchronously")
+
+    loop = asyncio.get_event_loop()
+    prepare_executor = ThreadPoolExecutor(max_workers=1)
+    execute_executor = ThreadPoolExecutor(max_workers=1)
+
+    def get_batches():
+        return helper.get_batches(
+            objs, meta=meta, update_fields=update_fields,
+            exclude_fields=exclude_fields, using=using,
+            batch_size=batch_size, pk_field=pk_field, strategy=strategy,
+            max_query_params=max_query_params, only_changed=only_changed,
+            returning=returning, version_field=version_field,
+            queryset=queryset, sort_pks=sort_pks, prepare=prepare,
+            pad_batches=pad_batches,
+        )
+
+    def prepare_next(plan, batches):
+        batch = next(batches, None)
+        if batch is None:
+            return None
+        fields, batch_objs = batch
+        (sql, parameters), prepare_time = helper._timed(
+            helper._prepare_batch, plan, batch_objs, connections[using],
+            fields)
+        return fields, batch_objs, sql, parameters, prepare_time
+
+    stale = [] if version_field is not None else None
+
+    def execute(plan, fields, batch_objs, sql, parameters, prepare_time):
+        rowcount, execute_time = helper._timed(
+            helper._execute_batch, connections[using], sql, parameters, plan,
+            batch_objs, stale)
+        helper._send_batch_updated(
+            plan, len(batch_objs), fields, sql, parameters, prepare_time,
+            execute_time, rowcount)
+        return rowcount
+
+    def close():
+        connections[using].close()
+
+    try:
+        plan, batches = await loop.run_in_executor(
+            prepare_executor, get_batches)
+        if plan is None:
+            return
+
+        rowcount = 0
+        prepared = await loop.run_in_executor(
+            prepare_executor, prepare_next, plan, batches)
+
+        while prepared is not None:
+            fields, batch_objs = prepared[:2]
+            execution = loop.run_in_executor(
+                execute_executor, execute, plan, *prepared)
+            next_prepared = loop.run_in_executor(
+                prepare_executor, prepare_next, plan, batches)
+            try:
+                rowcount += await execution
+            finally:
+                prepared = await next_prepared
+
+            if only_changed:
+                helper._refresh_snapshots(batch_objs, fields, stale)
+
+        if stale:
+            raise helper.StaleObjectsError(stale, rowcount)
+        return rowcount
+    finally:
+        await loop.run_in_executor(prepare_executor, close)
+        await loop.run_in_executor(execute_executor, close)
+        prepare_executor.shutdown(wait=False)
+        execute_executor.shutdown(wait=False)
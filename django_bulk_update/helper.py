@@ -2,13 +2,107 @@
 """
 Main module with the bulk_update function.
 """
+import binascii
+import copy
+import functools
+import io
 import itertools
+import re
+import threading
+import uuid
 
-from collections import defaultdict
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from timeit import default_timer
 
-from django.db import connections, models
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+from django.conf import settings
+from django.db import connections, models, transaction
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:  # django < 1.11
+    from django.db.models.sql.datastructures import EmptyResultSet
 from django.db.models.query import QuerySet
-from django.db.models.sql import UpdateQuery
+from django.db.models.sql import InsertQuery, UpdateQuery
+
+try:
+    from django.contrib.postgres.fields.jsonb import (
+        JSONField as _PostgresJSONField, JsonAdapter as _JsonAdapter,
+    )
+except ImportError:  # psycopg2 isn't installed, or an older django
+    _PostgresJSONField = None
+
+from . import signals
+from .tracking import get_changed_fields, has_snapshot, snapshot
+
+
+# 'case': one ``CASE pk WHEN ... THEN ...`` expression per field (any db).
+# 'values': join against a ``VALUES`` list (postgresql only).
+# 'copy': COPY into a temporary table and join against it (postgresql only).
+# 'join': join against a ``UNION ALL`` derived table (mysql only).
+STRATEGIES = ('case', 'values', 'copy', 'join')
+
+# The only vendor supporting each vendor-specific strategy
+STRATEGY_VENDORS = {
+    'values': 'postgresql',
+    'copy': 'postgresql',
+    'join': 'mysql',
+}
+
+# Max number of query parameters per vendor, for django versions whose
+# backends don't define `connection.features.max_query_params`.
+MAX_QUERY_PARAMS = {
+    'sqlite': 999,  # SQLITE_MAX_VARIABLE_NUMBER
+    'postgresql': 2 ** 16 - 1,
+    'mysql': 2 ** 16 - 1,
+    'oracle': 2 ** 16 - 1,
+}
+
+try:
+    _INTEGER_TYPES = frozenset([int, long])
+    _STRING_TYPES = frozenset([str, unicode])
+except NameError:  # python 3
+    _INTEGER_TYPES = frozenset([int])
+    _STRING_TYPES = frozenset([str])
+
+try:
+    _text_type = unicode
+except NameError:  # python 3
+    _text_type = str
+
+_NONE_TYPE = type(None)
+
+# Fields whose db value is the python value itself, when it's one of these
+# types; updates skip `get_db_prep_save` for them, see `_get_converters`.
+FAST_PATH_TYPES = {
+    models.IntegerField: _INTEGER_TYPES | {_NONE_TYPE},
+    models.BigIntegerField: _INTEGER_TYPES | {_NONE_TYPE},
+    models.SmallIntegerField: _INTEGER_TYPES | {_NONE_TYPE},
+    models.PositiveIntegerField: _INTEGER_TYPES | {_NONE_TYPE},
+    models.PositiveSmallIntegerField: _INTEGER_TYPES | {_NONE_TYPE},
+    models.AutoField: _INTEGER_TYPES | {_NONE_TYPE},
+    models.FloatField: _INTEGER_TYPES | {float, _NONE_TYPE},
+    models.BooleanField: frozenset([bool, _NONE_TYPE]),
+    models.NullBooleanField: frozenset([bool, _NONE_TYPE]),
+    models.CharField: _STRING_TYPES | {_NONE_TYPE},
+    models.TextField: _STRING_TYPES | {_NONE_TYPE},
+}
+
+# Max number of cached update plans, see `get_plan`.
+PLAN_CACHE_SIZE = 128
+
+# Max number of SQL skeletons, by batch length, kept in each plan, besides
+# the case clauses of two batch lengths (e.g. the full one and the last
+# one) for every field of its model.
+PLAN_SQL_CACHE_SIZE = 32
+
+# Max number of statements tracked on each connection, see
+# `PreparedStatements`.
+PREPARED_STATEMENTS_SIZE = 16
 
 
 def _get_db_type(field, connection):
@@ -20,9 +114,72 @@ def _get_db_type(field, connection):
     return field.db_type(connection)
 
 
-def _as_sql(obj, field, query, compiler, connection):
-    value = getattr(obj, field.attname)
+def _get_pk_db_type(field, connection):
+    # AutoField's db_type is "serial", which cannot be used in a cast
+    if hasattr(field, 'rel_db_type'):
+        return field.rel_db_type(connection)
+
+    return _get_db_type(field, connection)
+
+
+def _uuid_hex(value):
+    return value.hex
+
+
+def _datetime_converter(field, using):
+    def convert(value):
+        # converters are cached in plans, shared by threads
+        connection = connections[using]
+        if value.tzinfo is None and settings.USE_TZ:
+            # warns, and makes it aware in the default time zone
+            return field.get_db_prep_save(value, connection=connection)
+        return connection.ops.adapt_datetimefield_value(value)
+
+    return convert
+
+
+def _get_converters(field, connection):
+    """
+    Return the converters of the plain values of `field`, by type, which
+    don't need `_value_as_sql`: a function returning the db value of a
+    value, or None if it's the value itself. Values of other types,
+    expressions included, take the generic path.
+
+    Only exact field types are known, subclasses may prepare their values
+    differently.
+    """
+    field_type = type(field)
+
+    fast_path_types = FAST_PATH_TYPES.get(field_type)
+    if fast_path_types is not None:
+        return dict.fromkeys(fast_path_types)
+
+    if field_type is models.UUIDField:
+        return {
+            uuid.UUID: (
+                None if connection.features.has_native_uuid_field
+                else _uuid_hex),
+            _NONE_TYPE: None,
+        }
+
+    if field_type is models.DateTimeField:
+        return {
+            datetime: _datetime_converter(field, connection.alias),
+            _NONE_TYPE: None,
+        }
+
+    if _PostgresJSONField is not None and field_type is _PostgresJSONField:
+        adapt = functools.partial(_JsonAdapter, encoder=field.encoder)
+        return {dict: adapt, list: adapt, _NONE_TYPE: None}
+
+    return {}
+
+
+# The converter of values taking the generic path, see `_get_converters`
+_GENERIC = object()
 
+
+def _value_as_sql(value, field, query, compiler, connection):
     if hasattr(value, 'resolve_expression'):
         value = value.resolve_expression(query, allow_joins=False, for_save=True)
     else:
@@ -30,7 +187,10 @@ def _as_sql(obj, field, query, compiler, connection):
 
     if hasattr(value, 'as_sql'):
         placeholder, value = compiler.compile(value)
-        if isinstance(value, list):
+        if placeholder == '%s' and len(value) == 1:
+            # e.g. Value(x), bound as x itself
+            value = value[0]
+        else:
             value = tuple(value)
     else:
         placeholder = '%s'
@@ -56,6 +216,113 @@ def grouper(iterable, size):
         yield chunk
 
 
+def _query_params_limit(connection, max_query_params=None):
+    """
+    Return the backend's limit of query parameters, or `max_query_params`
+    if it's lower, or None if there isn't any limit.
+    """
+    limit = (
+        getattr(connection.features, 'max_query_params', None) or
+        MAX_QUERY_PARAMS.get(connection.vendor)
+    )
+    if max_query_params is not None:
+        limit = min(limit, max_query_params) if limit else max_query_params
+    return limit or None
+
+
+def get_batch_size(connection, params_per_obj, max_query_params=None,
+                   reserved_params=0):
+    """
+    Return how many objects fit in one query without exceeding the
+    backend's limit of query parameters, or `max_query_params` if it's
+    lower, once `reserved_params` are used by the rest of the query.
+    Return None if there isn't any limit.
+    """
+    limit = _query_params_limit(connection, max_query_params)
+    if limit is None:
+        return None
+
+    return max(1, (limit - reserved_params) // params_per_obj)
+
+
+def validate_strategy(strategy, connection):
+    if strategy not in STRATEGIES:
+        raise ValueError(
+            "Unknown strategy {!r}, choose one of: {}".format(
+                strategy, ', '.join(STRATEGIES))
+        )
+
+    vendor = STRATEGY_VENDORS.get(strategy, connection.vendor)
+    if vendor != connection.vendor:
+        raise ValueError(
+            "The {!r} strategy is only supported by {}, "
+            "not by {}".format(strategy, vendor, connection.vendor)
+        )
+
+
+def supports_returning(connection):
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == 'postgresql'
+
+
+def validate_returning(returning, strategy, connection):
+    if not returning:
+        return
+
+    if not supports_returning(connection):
+        raise ValueError(
+            "returning isn't supported by {}".format(connection.vendor))
+
+    if strategy not in ('case', 'values'):
+        raise ValueError(
+            "returning isn't supported by the {!r} strategy".format(strategy))
+
+
+def validate_prepare(prepare, strategy, connection):
+    if not prepare:
+        return
+
+    if connection.vendor != 'postgresql':
+        raise ValueError(
+            "prepare isn't supported by {}".format(connection.vendor))
+
+    if strategy == 'copy':
+        raise ValueError("prepare isn't supported by the 'copy' strategy")
+
+
+def validate_version_field(meta, version_field, strategy):
+    if version_field is None:
+        return
+
+    validate_fields(meta, [version_field])
+    if not isinstance(meta.get_field(version_field), models.IntegerField):
+        raise TypeError(
+            "{!r} isn't an integer field".format(version_field))
+
+    if strategy not in ('case', 'values'):
+        raise ValueError(
+            "version_field isn't supported by the {!r} strategy".format(
+                strategy))
+
+
+class StaleObjectsError(Exception):
+    """
+    Raised by `bulk_update` when some objects weren't updated because
+    their `version_field` changed in the database in the meantime.
+
+    `pks` are the pks of those objects, `rowcount` the number of rows
+    updated anyway (unless the update was atomic).
+    """
+
+    def __init__(self, pks, rowcount=None):
+        super(StaleObjectsError, self).__init__(
+            "{} stale objects: {}".format(
+                len(pks), ', '.join(map(str, pks[:10]))))
+        self.pks = pks
+        self.rowcount = rowcount
+
+
 def validate_fields(meta, fields):
 
     fields = frozenset(fields)
@@ -113,112 +380,2267 @@ def get_fields(update_fields, exclude_fields, meta, obj=None):
     return fields
 
 
-def bulk_update(objs, meta=None, update_fields=None, exclude_fields=None,
-                using='default', batch_size=None, pk_field='pk'):
-    assert batch_size is None or batch_size > 0
+def _compile_filter(queryset, plan):
+    """
+    Return the SQL, and its parameters, of the filters of `queryset` as a
+    condition on the rows of `plan`'s table ('' if there are none), or
+    None if they can't match any row (e.g. `queryset.none()`).
+    """
+    query = queryset.query
+    if query.model._meta.concrete_model is not plan.meta.concrete_model:
+        raise TypeError(
+            "Can't filter {} with a queryset of {}".format(
+                plan.meta.object_name, query.model._meta.object_name))
 
-    # force to retrieve objs from the DB at the beginning,
-    # to avoid multiple subsequent queries
-    objs = list(objs)
-    if not objs:
-        return
-    batch_size = batch_size or len(objs)
+    if not query.where:
+        return '', ()
 
-    if meta:
-        fields = get_fields(update_fields, exclude_fields, meta)
-    else:
-        meta = objs[0]._meta
-        if update_fields is not None:
-            fields = get_fields(update_fields, exclude_fields, meta, objs[0])
+    connection = plan.connection
+    compiler = query.get_compiler(connection=connection)
+    try:
+        if query.count_active_tables() <= 1:
+            return compiler.compile(query.where)
+
+        # Filters through relations, as in UPDATE queries: by pk, in a
+        # subquery
+        sql, params = queryset.order_by().values('pk').query.get_compiler(
+            connection=connection).as_sql()
+    except EmptyResultSet:
+        return None
+
+    if not connection.features.update_can_self_select:
+        # MySQL can't select from the table being updated
+        sql = 'SELECT * FROM ({}) AS {}'.format(
+            sql, plan.qn('bulk_update_filter'))
+    return '{}.{} IN ({})'.format(
+        plan.dbtable, plan.qn(plan.meta.pk.column), sql), params
+
+
+class UpdatePlan(object):
+    """
+    Everything about a model, its fields to update and a database that
+    doesn't depend on the objects being updated: the fields themselves,
+    quoted names, cast types and SQL skeletons by batch length.
+
+    Plans are built by `get_plan`, which caches them for every thread, so
+    they don't keep any connection (connections are thread-local): the
+    current thread's one is looked up when needed.
+    """
+
+    # The 'values' and 'join' strategies join the table against this alias
+    values_alias = 'bulk_update_values'
+
+    def __init__(self, meta, update_fields, exclude_fields, pk_field,
+                 connection, strategy, fields_per_object, returning=None,
+                 version_field=None):
+        # The version field is incremented, never updated from objects
+        if version_field is not None:
+            exclude_fields = list(exclude_fields or []) + [version_field]
+            version_field = meta.get_field(version_field)
+        self.version_field = version_field
+
+        self.meta = meta
+        self.update_fields = update_fields
+        self.exclude_fields = exclude_fields
+        self.strategy = strategy
+        self.using = connection.alias
+        self.vendor = connection.vendor
+
+        if fields_per_object:
+            # depend on the deferred fields of every object
+            self.fields = None
+            if exclude_fields is not None:
+                validate_fields(meta, exclude_fields)
         else:
-            fields = None
+            self.fields = get_fields(update_fields, exclude_fields, meta)
 
-    if fields is not None and len(fields) == 0:
-        return
+        if pk_field == 'pk':
+            self.pk_field = meta.get_field(meta.pk.name)
+        else:
+            self.pk_field = meta.get_field(pk_field)
 
-    if pk_field == 'pk':
-        pk_field = meta.get_field(meta.pk.name)
-    else:
-        pk_field = meta.get_field(pk_field)
+        # Identifiers are quoted once, here, the way the database expects
+        self.qn = qn = connection.ops.quote_name
+        self.dbtable = qn(meta.db_table)
 
-    connection = connections[using]
-    query = UpdateQuery(meta.model)
-    compiler = query.get_compiler(connection=connection)
+        # The case clause template; db-dependent
+        # Apparently, mysql's castable types are very limited and have
+        # nothing to do with the column types. Still, it handles the uncast
+        # types well enough... hopefully.
+        # http://dev.mysql.com/doc/refman/5.5/en/cast-functions.html#function_cast
+        #
+        # Sqlite also gives some trouble with cast, at least for datetime,
+        # but is also permissive for uncast values
+        self.use_cast = (
+            'mysql' not in self.vendor and 'sqlite' not in self.vendor
+        )
 
-    # The case clause template; db-dependent
-    # Apparently, mysql's castable types are very limited and have
-    # nothing to do with the column types. Still, it handles the uncast
-    # types well enough... hopefully.
-    # http://dev.mysql.com/doc/refman/5.5/en/cast-functions.html#function_cast
-    #
-    # Sqlite also gives some trouble with cast, at least for datetime,
-    # but is also permissive for uncast values
-    vendor = connection.vendor
-    use_cast = 'mysql' not in vendor and 'sqlite' not in vendor
-    if use_cast:
-        template = '"{column}" = CAST(CASE "{pk_column}" {cases}ELSE "{column}" END AS {type})'
-    else:
-        template = '"{column}" = (CASE "{pk_column}" {cases}ELSE "{column}" END)'
+        # The fields returned by the updates, led by the pk field
+        self.returning = ()
+        self.returning_sql = ''
+        if version_field is not None and supports_returning(connection):
+            # tells which rows were updated, and their new versions
+            returning = list(returning or []) + [version_field.name]
+        if returning:
+            self.returning = [self.pk_field]
+            for name in returning:
+                field = (
+                    meta.pk if name == 'pk' else meta.get_field(name))
+                if field not in self.returning:
+                    self.returning.append(field)
+            self.returning_sql = ' RETURNING {}'.format(', '.join(
+                '{}.{}'.format(self.dbtable, qn(field.column))
+                for field in self.returning
+            ))
+
+        # An extra condition on the updated rows, see `filtered`
+        self.filter_sql = ''
+        self.filter_params = ()
+
+        # Whether statements are prepared on the server, see `prepared`
+        self.prepare = False
+
+        # The (batch_size, max_query_params) limiting padded batches, or
+        # None if they aren't, see `padded`
+        self.pad_limits = None
+
+        self._fields_by_deferred = {}
+        self._converters = {}
+        self._case_templates = {}
+        self._sql_cache = OrderedDict()
+        self._sql_cache_size = (
+            PLAN_SQL_CACHE_SIZE + 2 * len(meta.concrete_fields))
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def get_compiler(self, connection):
+        """
+        Return a compiler of an update query of the model, to compile
+        expressions with.
+        """
+        return UpdateQuery(self.meta.model).get_compiler(connection=connection)
+
+    def filtered(self, queryset):
+        """
+        Return a copy of this plan only updating the rows matching the
+        filters of `queryset`, or None if they can't match any row.
+        """
+        compiled = _compile_filter(queryset, self)
+        if compiled is None:
+            return None
+        sql, params = compiled
+        if not sql:
+            return self
+
+        plan = copy.copy(self)
+        plan.filter_sql = sql
+        plan.filter_params = tuple(params)
+        return plan
+
+    def prepared(self):
+        """
+        Return a copy of this plan executing its statements as server-side
+        prepared statements (PostgreSQL only), see `PreparedStatements`.
+        """
+        plan = copy.copy(self)
+        plan.prepare = True
+        return plan
+
+    def padded(self, batch_size=None, max_query_params=None):
+        """
+        Return a copy of this plan padding every batch up to the next
+        power of two rows, but not above `batch_size` (or the batch size
+        given by `max_query_params`), so that there are only a few
+        different statements, see `_pad_batch`.
+        """
+        plan = copy.copy(self)
+        plan.pad_limits = (batch_size, max_query_params)
+        return plan
+
+    def get_fields(self, obj):
+        """
+        Return the fields to update for `obj`.
+        """
+        if self.fields is not None:
+            return self.fields
+
+        deferred_fields = frozenset(obj.get_deferred_fields())
+        try:
+            return self._fields_by_deferred[deferred_fields]
+        except KeyError:
+            fields = get_fields(
+                self.update_fields, self.exclude_fields, self.meta, obj)
+            self._fields_by_deferred[deferred_fields] = fields
+            return fields
+
+    def returning_converters(self, connection):
+        """
+        Return, for each returned field, its db converters on `connection`.
+        """
+        converters = []
+        for field in self.returning:
+            col = field.get_col(self.meta.db_table)
+            converters.append(
+                connection.ops.get_db_converters(col) +
+                col.get_db_converters(connection)
+            )
+        return converters
 
-    case_template = "WHEN %s THEN {} "
+    def populate(self, objs, rows):
+        """
+        Set the returned `rows` on the matching `objs`, and return those.
+        """
+        connection = self.connection
+        fields = self.returning
+        converters = self.returning_converters(connection)
+        attnames = [field.attname for field in fields]
 
-    lenpks = 0
-    for objs_batch in grouper(objs, batch_size):
+        objs_by_pk = {}
+        for obj in objs:
+            objs_by_pk[getattr(obj, attnames[0])] = obj
 
-        pks = []
-        parameters = defaultdict(list)
-        placeholders = defaultdict(list)
+        populated = []
+        for row in rows:
+            values = []
+            for value, field, field_converters in zip(
+                    row, fields, converters):
+                col = field.get_col(self.meta.db_table)
+                for converter in field_converters:
+                    value = converter(value, col, connection)
+                values.append(value)
 
-        for obj in objs_batch:
+            obj = objs_by_pk.get(values[0])
+            if obj is None:
+                continue
+            for attname, value in zip(attnames, values):
+                setattr(obj, attname, value)
+            if has_snapshot(obj):
+                snapshot(obj, fields)
+            populated.append(obj)
 
-            pk_value, _ = _as_sql(obj, pk_field, query, compiler, connection)
-            pks.append(pk_value)
+        return populated
 
-            loaded_fields = fields or get_fields(update_fields, exclude_fields, meta, obj)
+    def converters(self, field):
+        """
+        Return the converters of the plain values of `field`, see
+        `_get_converters`.
+        """
+        try:
+            return self._converters[field]
+        except KeyError:
+            converters = _get_converters(field, self.connection)
+            self._converters[field] = converters
+            return converters
 
-            for field in loaded_fields:
-                value, placeholder = _as_sql(obj, field, query, compiler, connection)
-                parameters[field].extend(flatten([pk_value, value], types=tuple))
-                placeholders[field].append(placeholder)
+    def _cached(self, key, build):
+        # a LRU cache, shared by the copies of the plan
+        with self._lock:
+            try:
+                value = self._sql_cache.pop(key)
+            except KeyError:
+                pass
+            else:
+                self._sql_cache[key] = value
+                return value
 
-        values = ', '.join(
-            template.format(
-                column=field.column,
-                pk_column=pk_field.column,
-                cases=(case_template*len(placeholders[field])).format(*placeholders[field]),
-                type=_get_db_type(field, connection=connection),
+        value = build()
+        with self._lock:
+            self._sql_cache[key] = value
+            while len(self._sql_cache) > self._sql_cache_size:
+                self._sql_cache.popitem(last=False)
+        return value
+
+    def _case_template(self, field, searched=False):
+        """
+        Return the (head, tail) of the case clause of `field`, with
+        `WHEN %s THEN ...` branches to be put in between or, if `searched`,
+        `WHEN <condition> THEN ...` ones.
+        """
+        key = (field, searched)
+        try:
+            return self._case_templates[key]
+        except KeyError:
+            pass
+
+        column = self.qn(field.column)
+        pk_column = '' if searched else self.qn(self.pk_field.column) + ' '
+        if self.use_cast:
+            template = (
+                '{column} = CAST(CASE {pk_column}',
+                'ELSE {column} END AS {type})',
+            )
+        else:
+            template = (
+                '{column} = (CASE {pk_column}',
+                'ELSE {column} END)',
+            )
+        template = tuple(
+            part.format(
+                column=column,
+                pk_column=pk_column,
+                type=(
+                    _get_db_type(field, connection=self.connection)
+                    if self.use_cast else None
+                ),
+            )
+            for part in template
+        )
+
+        self._case_templates[key] = template
+        return template
+
+    def case_sql(self, field, n, placeholders=None):
+        """
+        Return the `field = CASE ...` assignment for a batch of `n` values,
+        with the given placeholders or, by default, all '%s'.
+        """
+        case_template = "WHEN %s THEN {} "
+
+        if placeholders is None:
+            # The common case, no expression: reuse the skeleton
+            return self._cached(
+                ('case', field, n),
+                lambda: (case_template.format('%s') * n).join(
+                    self._case_template(field)),
             )
-            for field in parameters.keys()
+
+        cases = (case_template * n).format(*placeholders)
+        return cases.join(self._case_template(field))
+
+    def set_sql(self, fields, n):
+        """
+        Return the case clause assignments of `fields` for a batch of `n`
+        values, all of them '%s'.
+        """
+        return self._cached(
+            ('set', tuple(fields), n),
+            lambda: ', '.join(self.case_sql(field, n) for field in fields),
+        )
+
+    def grouped_case_sql(self, field, sizes, placeholder='%s'):
+        """
+        Return the `field = ...` assignment for groups of rows sharing a
+        value, with the given number of rows each: a
+        `CASE WHEN pk IN (...) THEN %s ...` clause or, if all the rows
+        share the same value, a plain '%s' (or the `placeholder` of the
+        expression they share).
+        """
+        column = self.qn(field.column)
+
+        if len(sizes) == 1:
+            if self.use_cast:
+                return '{} = CAST({} AS {})'.format(
+                    column, placeholder,
+                    _get_db_type(field, connection=self.connection))
+            return '{} = {}'.format(column, placeholder)
+
+        pk_column = self.qn(self.pk_field.column)
+        cases = ''.join(
+            'WHEN {} IN ({}) THEN %s '.format(
+                pk_column, ', '.join(itertools.repeat('%s', size)))
+            for size in sizes
         )
+        return cases.join(self._case_template(field, searched=True))
 
-        parameters = flatten(parameters.values(), types=list)
-        parameters.extend(pks)
+    def in_clause(self, n_pks):
+        return self._cached(
+            ('in', n_pks),
+            lambda: '{pk_column} in ({pks})'.format(
+                pk_column=self.qn(self.pk_field.column),
+                pks=', '.join(itertools.repeat('%s', n_pks)),
+            ),
+        )
+
+    def values_sql(self, fields, n_pks):
+        """
+        Return an ``UPDATE ... FROM (VALUES ...)`` statement (PostgreSQL
+        only) for `n_pks` rows of a pk followed by the values of `fields`.
+
+        None of those values can be an expression, since the VALUES list
+        can't reference the updated table.
+        """
+        return self._cached(
+            ('values', tuple(fields), n_pks),
+            lambda: self._values_sql(fields, n_pks),
+        )
+
+    def version_sql(self, n_pks):
+        """
+        Return the assignment incrementing the version field and the
+        condition matching the expected versions of `n_pks` rows, by pk.
+        """
+        # cast, like the case clauses, so that prepared statements know
+        # the type of the versions
+        condition = (
+            ' AND {column} = CAST(CASE {pk_column} {cases}END AS {type})'
+            if self.use_cast else
+            ' AND {column} = CASE {pk_column} {cases}END'
+        )
+        return self._cached(('version', n_pks), lambda: (
+            '{column} = {column} + 1'.format(
+                column=self.qn(self.version_field.column)),
+            condition.format(
+                column=self.qn(self.version_field.column),
+                pk_column=self.qn(self.pk_field.column),
+                cases='WHEN %s THEN %s ' * n_pks,
+                type=(
+                    _get_db_type(self.version_field, self.connection)
+                    if self.use_cast else None
+                ),
+            ),
+        ))
+
+    def locking_sql(self, n_pks, filtered=True):
+        """
+        Return a query selecting, and locking, the pks of `n_pks` rows
+        whose version is the expected one (and, if `filtered`, matching
+        the filter).
+        """
+        sql = self._cached(('locking', n_pks), lambda: (
+            'SELECT {pk_column} FROM {dbtable} WHERE {in_clause}{versions}'
+        ).format(
+            pk_column=self.qn(self.pk_field.column),
+            dbtable=self.dbtable,
+            in_clause=self.in_clause(n_pks),
+            versions=self.version_sql(n_pks)[1],
+        ))
+        if filtered and self.filter_sql:
+            sql += ' AND ({})'.format(self.filter_sql)
+        if self.connection.features.has_select_for_update:
+            sql += ' FOR UPDATE'
+        return sql
+
+    def join_sql(self, fields, n_pks):
+        """
+        Return an ``UPDATE ... JOIN (SELECT ... UNION ALL ...)`` statement
+        (MySQL only) for `n_pks` rows of a pk followed by the values of
+        `fields`.
+
+        As with `values_sql`, none of those values can be an expression.
+        """
+        return self._cached(
+            ('join', tuple(fields), n_pks),
+            lambda: self._join_sql(fields, n_pks),
+        )
+
+    def _join_sql(self, fields, n_pks):
+        qn = self.qn
+        alias = qn(self.values_alias)
+        pk_column = qn(self.pk_field.column)
+        columns = [qn(field.column) for field in fields]
+
+        # Only the first row names the columns of the derived table
+        first = 'SELECT {}'.format(', '.join(
+            '%s AS {}'.format(column) for column in [pk_column] + columns))
+        row = 'SELECT {}'.format(
+            ', '.join(itertools.repeat('%s', len(columns) + 1)))
+        rows = ' UNION ALL '.join(
+            itertools.chain([first], itertools.repeat(row, n_pks - 1)))
+
+        assignments = ', '.join(
+            '{dbtable}.{column} = {alias}.{column}'.format(
+                dbtable=self.dbtable, column=column, alias=alias)
+            for column in columns
+        )
+
+        return (
+            'UPDATE {dbtable} JOIN ({rows}) AS {alias} USING ({pk_column}) '
+            'SET {assignments}'
+        ).format(
+            dbtable=self.dbtable,
+            rows=rows,
+            alias=alias,
+            pk_column=pk_column,
+            assignments=assignments,
+        )
 
-        n_pks = len(pks)
-        del pks
+    def copy_sql(self, fields, idx):
+        """
+        Return the statements creating the `idx`-th temporary table of the
+        'copy' strategy (PostgreSQL only) for `fields`, copying rows into
+        it, updating the table from it and dropping it.
+        """
+        return self._cached(
+            ('copy', tuple(fields), idx),
+            lambda: self._copy_sql(fields, idx),
+        )
+
+    def _copy_sql(self, fields, idx):
+        qn = self.qn
+        pk_field = self.pk_field
+        pk_column = qn(pk_field.column)
+        table = qn('bulk_update_copy_{}'.format(idx))
+
+        columns = ', '.join(
+            '{} {}'.format(qn(column), db_type)
+            for column, db_type in [(
+                pk_field.column,
+                _get_pk_db_type(pk_field, self.connection),
+            )] + [
+                (field.column, _get_db_type(field, self.connection))
+                for field in fields
+            ]
+        )
+        create = 'CREATE TEMPORARY TABLE {table} ({columns})'.format(
+            table=table, columns=columns)
+
+        copy = 'COPY {table} FROM STDIN'.format(table=table)
+
+        update = (
+            'UPDATE {dbtable} SET {assignments} FROM {table} '
+            'WHERE {dbtable}.{pk_column} = {table}.{pk_column}'
+        ).format(
+            dbtable=self.dbtable,
+            assignments=', '.join(
+                '{column} = {table}.{column}'.format(
+                    column=qn(field.column), table=table)
+                for field in fields
+            ),
+            table=table,
+            pk_column=pk_column,
+        )
+
+        drop = 'DROP TABLE {table}'.format(table=table)
 
-        dbtable = '"{}"'.format(meta.db_table)
+        return create, copy, update, drop
 
-        in_clause = '"{pk_column}" in ({pks})'.format(
-            pk_column=pk_field.column,
-            pks=', '.join(itertools.repeat('%s', n_pks)),
+    def _values_sql(self, fields, n_pks):
+        qn = self.qn
+        pk_field = self.pk_field
+        alias = qn(self.values_alias)
+
+        casts = [
+            'CAST(%s AS {})'.format(
+                _get_pk_db_type(pk_field, self.connection))
+        ]
+        value_fields = list(fields)
+        if self.version_field is not None:
+            value_fields.append(self.version_field)
+        casts.extend(
+            'CAST(%s AS {})'.format(
+                _get_db_type(field, connection=self.connection))
+            for field in value_fields
+        )
+        row = '({})'.format(', '.join(casts))
+
+        columns = ', '.join(
+            qn(column)
+            for column in [pk_field.column] + [
+                field.column for field in value_fields]
+        )
+
+        assignments = [
+            '{column} = {alias}.{column}'.format(column=qn(field.column),
+                                                 alias=alias)
+            for field in fields
+        ]
+        versions = ''
+        if self.version_field is not None:
+            version_column = qn(self.version_field.column)
+            assignments.append('{column} = {dbtable}.{column} + 1'.format(
+                column=version_column, dbtable=self.dbtable))
+            versions = ' AND {dbtable}.{column} = {alias}.{column}'.format(
+                dbtable=self.dbtable, column=version_column, alias=alias)
+        assignments = ', '.join(assignments)
+
+        return (
+            'UPDATE {dbtable} SET {assignments} '
+            'FROM (VALUES {rows}) AS {alias} ({columns}) '
+            'WHERE {dbtable}.{pk_column} = {alias}.{pk_column}{versions}'
+        ).format(
+            versions=versions,
+            dbtable=self.dbtable,
+            assignments=assignments,
+            rows=', '.join(itertools.repeat(row, n_pks)),
+            alias=alias,
+            columns=columns,
+            pk_column=qn(pk_field.column),
         )
 
-        sql = 'UPDATE {dbtable} SET {values} WHERE {in_clause}'.format(
-            dbtable=dbtable,
-            values=values,
-            in_clause=in_clause,
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class PlanCache(object):
+    """
+    Thread safe LRU cache of update plans.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            try:
+                plan = self._plans.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._plans[key] = plan
+                return plan
+
+        plan = build()
+
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._plans))
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = self.misses = 0
+
+
+_plan_cache = PlanCache(PLAN_CACHE_SIZE)
+
+
+def plan_cache_info():
+    """
+    Return the hits, misses, maxsize and currsize of the plan cache.
+    """
+    return _plan_cache.info()
+
+
+def clear_plan_cache():
+    _plan_cache.clear()
+
+
+def get_plan(meta, update_fields=None, exclude_fields=None, pk_field='pk',
+             using='default', strategy='case', fields_per_object=False,
+             returning=None, version_field=None):
+    """
+    Return the (cached) `UpdatePlan` of `meta` for the given arguments.
+
+    If `fields_per_object` is True and `update_fields` is None, the
+    fields to update depend on the deferred fields of every object.
+    """
+    connection = connections[using]
+    fields_per_object = fields_per_object and update_fields is None
+    key = (
+        meta.model,
+        None if update_fields is None else frozenset(update_fields),
+        None if exclude_fields is None else frozenset(exclude_fields),
+        pk_field,
+        using,
+        connection.vendor,
+        strategy,
+        fields_per_object,
+        tuple(returning) if returning else None,
+        version_field,
+    )
+    return _plan_cache.get(key, lambda: UpdatePlan(
+        meta, update_fields, exclude_fields, pk_field, connection, strategy,
+        fields_per_object, returning, version_field,
+    ))
+
+
+def _get_fields_batch_size(plan, connection, n_fields, max_query_params):
+    # Each object contributes its pk to the IN clause plus, per field,
+    # a pk/value pair to the case clause or a value to the VALUES list.
+    params_per_field = 1 if plan.strategy in ('values', 'join') else 2
+    if plan.version_field is not None:
+        # the expected version is compared like a field
+        n_fields += 1
+    # and the filters' parameters are sent with every batch
+    return get_batch_size(
+        connection, 1 + params_per_field * n_fields, max_query_params,
+        len(plan.filter_params))
+
+
+def _row_params(plan, columns, placeholders):
+    """
+    Return how many parameters each row of prepared `columns` takes in the
+    case clauses, with all the parameters of its expressions, or None if
+    there isn't any expression: `_get_fields_batch_size` counts one per
+    value.
+    """
+    if all(field_placeholders is None for field_placeholders in placeholders):
+        return None
+
+    n_fields = len(columns) + (plan.version_field is not None)
+    row_params = [1 + 2 * n_fields] * len(columns[0])
+    for column, field_placeholders in zip(columns, placeholders):
+        if field_placeholders is None:
+            continue
+        for idx, value in enumerate(column):
+            if isinstance(value, tuple):
+                row_params[idx] += len(value) - 1
+    return row_params
+
+
+def _split_rows(row_params, budget):
+    """
+    Yield the `(start, end)` slices of consecutive rows whose parameters
+    fit in `budget` (or of single rows which don't fit on their own).
+    """
+    start = used = 0
+    for idx, n_params in enumerate(row_params):
+        if idx > start and used + n_params > budget:
+            yield start, idx
+            start, used = idx, 0
+        used += n_params
+    yield start, len(row_params)
+
+
+def _split_expression_batches(plan, batches, connection, limit):
+    """
+    Split the `(fields, objs)` batches whose objects are assigned
+    expressions, so that their parameters don't exceed `limit`.
+    """
+    budget = limit - len(plan.filter_params)
+    for fields, objs in batches:
+        if not any(
+            hasattr(getattr(obj, field.attname), 'resolve_expression')
+            for field in fields for obj in objs
+        ):
+            yield fields, objs
+            continue
+
+        _, columns, placeholders = _collect_batch(
+            plan, objs, connection, fields)
+        row_params = _row_params(plan, columns, placeholders)
+        if row_params is None:
+            yield fields, objs
+            continue
+        for start, end in _split_rows(row_params, budget):
+            yield fields, objs[start:end]
+
+
+def _field_batches(plan, objs, batch_size, connection, max_query_params,
+                   only_changed=False):
+    """
+    Group objs by the fields to update, which depend on their deferred
+    fields and, if `only_changed`, on the fields that changed since their
+    snapshot (see `django_bulk_update.tracking`).
+
+    Yield `(fields, objs)` batches whose objects have all the same fields
+    to update; a group is yielded as soon as it reaches its batch size.
+    Objects without any field to update are skipped.
+    """
+    buckets = {}
+    sizes = {}
+
+    for obj in objs:
+        fields = plan.get_fields(obj)
+        if only_changed:
+            fields = get_changed_fields(obj, fields)
+            key = tuple(fields)
+        else:
+            # the plan returns the same list for the same deferred fields
+            key = id(fields)
+
+        if not fields:
+            continue
+
+        try:
+            bucket = buckets[key]
+        except KeyError:
+            bucket = buckets[key] = (fields, [])
+            sizes[key] = batch_size or _get_fields_batch_size(
+                plan, connection, len(fields), max_query_params)
+
+        bucket[1].append(obj)
+        if len(bucket[1]) == sizes[key]:
+            del buckets[key]
+            yield bucket
+
+    for bucket in buckets.values():
+        yield bucket
+
+
+def _collect_batch(plan, objs, connection, fields):
+    """
+    Return the pks of `objs`, the values of each field (one list per field)
+    and their placeholders (one list per field, or None if all of them are
+    '%s', which is the common case).
+    """
+    pks = _collect_column(plan, objs, plan.pk_field, connection)[0]
+
+    columns = []
+    placeholders = []
+    for field in fields:
+        column, field_placeholders = _collect_column(
+            plan, objs, field, connection)
+        columns.append(column)
+        placeholders.append(field_placeholders)
+
+    return pks, columns, placeholders
+
+
+def _collect_column(plan, objs, field, connection):
+    """
+    Return the db values of `field` of `objs`, and their placeholders (or
+    None if all of them are '%s').
+    """
+    attname = field.attname
+    return _prepare_values(
+        plan, field, [getattr(obj, attname) for obj in objs], connection)
+
+
+def _prepare_values(plan, field, column, connection):
+    """
+    Replace the values of `field` in the list `column` by their db values,
+    and return it with their placeholders (or None if all of them are
+    '%s').
+
+    Expressions are compiled once for consecutive equal ones, e.g. the
+    same `F('age') + 1` assigned to every object.
+    """
+    # only compiled values need a compiler
+    compiler = None
+    converters = plan.converters(field)
+
+    placeholders = None
+    # the last expression, and its compiled sql, reused for equal ones
+    expression = compiled = None
+
+    for idx, value in enumerate(column):
+        convert = converters.get(type(value), _GENERIC)
+        if convert is None:
+            continue
+        elif convert is not _GENERIC:
+            column[idx] = convert(value)
+            continue
+
+        if (expression is not None and
+                hasattr(value, 'resolve_expression') and
+                value == expression):
+            db_value, placeholder = compiled
+        else:
+            if compiler is None:
+                compiler = plan.get_compiler(connection)
+            db_value, placeholder = _value_as_sql(
+                value, field, compiler.query, compiler, connection)
+            if placeholder != '%s':
+                expression, compiled = value, (db_value, placeholder)
+
+        column[idx] = db_value
+        # the parameters of an expression are spread by their placeholder
+        if placeholder != '%s' or isinstance(db_value, tuple) and hasattr(
+                value, 'resolve_expression'):
+            if placeholders is None:
+                placeholders = ['%s'] * len(column)
+            placeholders[idx] = placeholder
+
+    return column, placeholders
+
+
+def _group_values(pks, column):
+    """
+    Return the distinct values of `column` with the `pks` having each one,
+    as `(value, pks)` pairs, or None if more than half of the values are
+    distinct (or can't be compared), since grouping wouldn't pay off then.
+    """
+    n_pks = len(pks)
+    if n_pks < 2:
+        return None
+    max_groups = n_pks // 2
+
+    # Most columns are mostly distinct, bail out on a sample first
+    try:
+        sample = column[:32]
+        distinct = set((type(value), value) for value in sample)
+        if len(distinct) * 2 > len(sample):
+            return None
+
+        groups = OrderedDict()
+        for pk_value, value in zip(pks, column):
+            key = (type(value), value)
+            group = groups.get(key)
+            if group is None:
+                if len(groups) == max_groups:
+                    return None
+                group = groups[key] = []
+            group.append(pk_value)
+    except TypeError:
+        # unhashable values
+        return None
+
+    return [(key[1], group) for key, group in groups.items()]
+
+
+def _shared_expression(pks, column, placeholders):
+    """
+    Return the expression of `column` as a single group, like
+    `_group_values` does, if every row has the same one (the same SQL and
+    parameters), otherwise None.
+    """
+    placeholder = placeholders[0]
+    value = column[0]
+    if placeholder == '%s':
+        return None
+
+    for other_placeholder, other_value in zip(placeholders, column):
+        if other_placeholder != placeholder or other_value != value:
+            return None
+
+    return [(value, pks)]
+
+
+def _case_parameters(pks, columns, placeholders, groups=None):
+    """
+    Return the parameters of the case clauses: a pk and a value (or the
+    parameters of an expression) per object and field, or the pks then
+    the value of each group of a grouped field, or the value (or the
+    parameters of the expression) shared by all the rows, then the pks of
+    the IN clause.
+    """
+    n_pks = len(pks)
+    if groups is None:
+        groups = [None] * len(columns)
+
+    sizes = [
+        (
+            2 * n_pks if field_placeholders is None else n_pks + sum(
+                len(value) if isinstance(value, tuple) else 1
+                for value in column
+            )
+        ) if field_groups is None else (
+            n_pks + len(field_groups) if len(field_groups) > 1 else
+            # a single group is a plain value, or a shared expression
+            len(field_groups[0][0]) if field_placeholders is not None and
+            isinstance(field_groups[0][0], tuple) else 1
         )
-        del values
+        for column, field_placeholders, field_groups in zip(
+            columns, placeholders, groups)
+    ]
+
+    parameters = [None] * (sum(sizes) + n_pks)
+    start = 0
+    for column, field_placeholders, field_groups, size in zip(
+            columns, placeholders, groups, sizes):
+        end = start + size
+        if field_groups is not None:
+            value = field_groups[0][0]
+            if len(field_groups) == 1:
+                if field_placeholders is not None and isinstance(
+                        value, tuple):
+                    parameters[start:end] = value
+                else:
+                    parameters[start] = value
+            else:
+                idx = start
+                for value, group_pks in field_groups:
+                    parameters[idx:idx + len(group_pks)] = group_pks
+                    idx += len(group_pks)
+                    parameters[idx] = value
+                    idx += 1
+        elif field_placeholders is None:
+            parameters[start:end:2] = pks
+            parameters[start + 1:end:2] = column
+        else:
+            idx = start
+            for pk_value, value in zip(pks, column):
+                parameters[idx] = pk_value
+                idx += 1
+                if isinstance(value, tuple):
+                    parameters[idx:idx + len(value)] = value
+                    idx += len(value)
+                else:
+                    parameters[idx] = value
+                    idx += 1
+        start = end
+
+    parameters[start:] = pks
+    return parameters
 
-        # String escaping in ANSI SQL is done by using double quotes (").
-        # Unfortunately, this escaping method is not portable to MySQL,
-        # unless it is set in ANSI compatibility mode.
-        if 'mysql' in vendor:
-            sql = sql.replace('"', '`')
 
-        lenpks += n_pks
+def _values_parameters(pks, columns):
+    """
+    Return the parameters of the VALUES list: a pk followed by the value
+    of each field, per object.
+    """
+    step = len(columns) + 1
+    parameters = [None] * (len(pks) * step)
+    parameters[0::step] = pks
+    for idx, column in enumerate(columns, 1):
+        parameters[idx::step] = column
+    return parameters
 
-        connection.cursor().execute(sql, parameters)
 
-    return lenpks
+def _prepare_batch(plan, objs, connection, fields):
+    """
+    Return the query, and its parameters, updating `fields` of `objs`.
+    """
+    pks, columns, placeholders = _collect_batch(plan, objs, connection, fields)
+    versions = None
+    if plan.version_field is not None:
+        versions = _collect_versions(plan, objs, connection)
+    return _batch_sql(plan, fields, pks, columns, placeholders, versions)
+
+
+def _collect_versions(plan, objs, connection):
+    return _collect_column(plan, objs, plan.version_field, connection)[0]
+
+
+def _padded_length(plan, n_pks, n_fields):
+    """
+    Return the power of two `n_pks` rows are padded up to, or the batch
+    size if it's lower.
+    """
+    length = 1 << (n_pks - 1).bit_length()
+    batch_size, max_query_params = plan.pad_limits
+    limit = batch_size or _get_fields_batch_size(
+        plan, plan.connection, n_fields, max_query_params)
+    if limit is not None:
+        length = min(length, limit)
+    return max(length, n_pks)
+
+
+def _pad_batch(plan, fields, pks, columns, placeholders, versions):
+    """
+    Pad a batch up to its padded length by repeating its last row, which
+    sets the same values on the same row again and changes neither the
+    result nor the rowcount.
+    """
+    if any(field_placeholders is not None
+           for field_placeholders in placeholders):
+        # expressions have their own statements, and more parameters
+        return pks, columns, placeholders, versions
+
+    padding = _padded_length(plan, len(pks), len(fields)) - len(pks)
+    if not padding:
+        return pks, columns, placeholders, versions
+
+    def pad(values):
+        return values + values[-1:] * padding
+
+    return (
+        pad(pks),
+        [pad(column) for column in columns],
+        [
+            None if field_placeholders is None else pad(field_placeholders)
+            for field_placeholders in placeholders
+        ],
+        None if versions is None else pad(versions),
+    )
+
+
+def _batch_sql(plan, fields, pks, columns, placeholders, versions=None):
+    """
+    Return the query, and its parameters, setting the `fields` of the rows
+    with the given `pks` to the prepared values in `columns`, and, with a
+    version field, whose version is in `versions`.
+    """
+    if plan.pad_limits is not None:
+        pks, columns, placeholders, versions = _pad_batch(
+            plan, fields, pks, columns, placeholders, versions)
+    n_pks = len(pks)
+
+    # The 'values' and 'join' strategies need plain values, without
+    # expressions, otherwise fall back to the case clause for this batch.
+    if plan.strategy in ('values', 'join') and all(
+        field_placeholders is None for field_placeholders in placeholders
+    ):
+        if plan.strategy == 'values':
+            sql = plan.values_sql(fields, n_pks)
+            if plan.filter_sql:
+                sql += ' AND ({})'.format(plan.filter_sql)
+            sql += plan.returning_sql
+        else:
+            sql = plan.join_sql(fields, n_pks)
+            if plan.filter_sql:
+                sql += ' WHERE {}'.format(plan.filter_sql)
+        if versions is not None:
+            columns = columns + [versions]
+        parameters = _values_parameters(pks, columns)
+        parameters.extend(plan.filter_params)
+        return sql, parameters
+
+    # Fields whose rows share few values get one branch per value, unless
+    # padded or prepared batches have to keep the same statements whatever
+    # their values or some pk is in the batch twice (the first of its
+    # values has to win, as in case clauses), and an expression shared by
+    # all the rows is set once, out of any case clause
+    grouped = (plan.pad_limits is None and not plan.prepare and
+               len(set(pks)) == n_pks)
+    groups = [
+        (
+            _group_values(pks, column) if grouped else None
+        ) if field_placeholders is None else _shared_expression(
+            pks, column, field_placeholders)
+        for column, field_placeholders in zip(columns, placeholders)
+    ]
+    if all(field_groups is None and field_placeholders is None
+           for field_groups, field_placeholders in zip(groups, placeholders)):
+        # The common case, no expression nor group: reuse the whole clause
+        values = [plan.set_sql(fields, n_pks)]
+    else:
+        values = [
+            plan.case_sql(field, n_pks, field_placeholders)
+            if field_groups is None else plan.grouped_case_sql(
+                field, [len(group_pks) for _, group_pks in field_groups],
+                '%s' if field_placeholders is None
+                else field_placeholders[0])
+            for field, field_placeholders, field_groups in zip(
+                fields, placeholders, groups)
+        ]
+    condition = ''
+    if versions is not None:
+        increment, condition = plan.version_sql(n_pks)
+        values.append(increment)
+
+    if plan.filter_sql:
+        condition += ' AND ({})'.format(plan.filter_sql)
+
+    sql = (
+        'UPDATE {dbtable} SET {values} WHERE {in_clause}{condition}'
+        '{returning}'
+    ).format(
+        dbtable=plan.dbtable,
+        values=', '.join(values),
+        in_clause=plan.in_clause(n_pks),
+        condition=condition,
+        returning=plan.returning_sql,
+    )
+    del values
+
+    parameters = _case_parameters(pks, columns, placeholders, groups)
+    if versions is not None:
+        parameters.extend(_version_parameters(pks, versions))
+    parameters.extend(plan.filter_params)
+    return sql, parameters
+
+
+def _version_parameters(pks, versions):
+    parameters = [None] * (2 * len(pks))
+    parameters[0::2] = pks
+    parameters[1::2] = versions
+    return parameters
+
+
+def _prepare_column(field, column, plan, connection):
+    """
+    Return the db values of `column`, a sequence of values of `field`, and
+    their placeholders (or None if all of them are '%s').
+    """
+    if hasattr(column, 'tolist'):
+        # numpy arrays, with python scalars instead of numpy ones
+        column = column.tolist()
+
+    converters = plan.converters(field)
+    if all(converters.get(value_type, _GENERIC) is None
+           for value_type in set(map(type, column))):
+        # get_db_prep_save wouldn't change any of these values
+        return list(column), None
+
+    return _prepare_values(plan, field, list(column), connection)
+
+
+def _copy_text(value):
+    """
+    Return `value`, as prepared for the db, in the text format of
+    PostgreSQL's COPY.
+    """
+    if value is None:
+        return '\\N'
+
+    if hasattr(value, 'adapted') and not hasattr(value, 'dumps'):
+        # psycopg2's Binary adapter, from BinaryField on PostgreSQL
+        value = value.adapted
+
+    if isinstance(value, bool):
+        text = 't' if value else 'f'
+    elif isinstance(value, (list, tuple)):
+        text = _copy_array(value)
+    elif hasattr(value, 'adapted') and hasattr(value, 'dumps'):
+        # psycopg2's Json adapter
+        text = value.dumps(value.adapted)
+    elif hasattr(value, 'isoformat'):
+        text = value.isoformat()
+    elif isinstance(value, (bytes, bytearray, memoryview)) and (
+            not isinstance(value, str)):
+        text = '\\x' + binascii.hexlify(bytes(value)).decode('ascii')
+    else:
+        text = _text_type(value)
+
+    return (
+        text.replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def _copy_array(values):
+    """
+    Return a PostgreSQL array literal of `values`.
+    """
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, (list, tuple)):
+            items.append(_copy_array(value))
+        else:
+            if isinstance(value, bool):
+                value = 't' if value else 'f'
+            elif hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            items.append('"{}"'.format(
+                _text_type(value).replace('\\', '\\\\').replace('"', '\\"')))
+    return '{{{}}}'.format(','.join(items))
+
+
+def _copy_update(plan, connection, batches):
+    """
+    Update `(fields, pks, columns, placeholders)` batches with the 'copy'
+    strategy: rows are copied into a temporary table per set of fields,
+    which is joined against by one UPDATE, at the end, all in a single
+    transaction.
+
+    Batches with expressions can't be copied and are updated right away,
+    with case clauses.
+
+    Return the number of updated rows.
+    """
+    tables = OrderedDict()
+    rowcount = 0
+
+    with transaction.atomic(using=plan.using):
+        cursor = connection.cursor()
+
+        for fields, pks, columns, placeholders in batches:
+            if any(field_placeholders is not None
+                   for field_placeholders in placeholders):
+                sql, parameters = _batch_sql(
+                    plan, fields, pks, columns, placeholders)
+                rowcount += _execute_batch(connection, sql, parameters)
+                continue
+
+            key = tuple(fields)
+            if key not in tables:
+                tables[key] = plan.copy_sql(fields, len(tables))
+                cursor.execute(tables[key][0])
+
+            rows = io.StringIO()
+            for row in zip(pks, *columns):
+                rows.write(u'\t'.join(_copy_text(value) for value in row))
+                rows.write(u'\n')
+            rows.seek(0)
+            cursor.copy_expert(tables[key][1], rows)
+
+        for create_sql, copy_sql, update_sql, drop_sql in tables.values():
+            if plan.filter_sql:
+                cursor.execute(
+                    '{} AND ({})'.format(update_sql, plan.filter_sql),
+                    plan.filter_params)
+            else:
+                cursor.execute(update_sql)
+            rowcount += cursor.rowcount
+            cursor.execute(drop_sql)
+
+    return rowcount
+
+
+def _update_batches_copy(plan, batches, connection, refresh=None):
+    """
+    Update `(fields, objs)` batches with the 'copy' strategy, see
+    `_copy_update`, then call `refresh(objs, fields)` for each of them.
+    """
+    updated = []
+
+    def collect():
+        for fields, objs in batches:
+            pks, columns, placeholders = _collect_batch(
+                plan, objs, connection, fields)
+            if refresh is not None:
+                updated.append((objs, fields))
+            yield fields, pks, columns, placeholders
+
+    rowcount = _copy_update(plan, connection, collect())
+
+    for objs, fields in updated:
+        refresh(objs, fields)
+
+    return rowcount
+
+
+_PLACEHOLDER_RE = re.compile('%([s%])')
+
+
+def _numbered_placeholders(sql):
+    """
+    Return `sql` with its '%s' placeholders numbered '$1', '$2', ... and
+    its '%%' unescaped, as `PREPARE` expects.
+    """
+    counter = itertools.count(1)
+    return _PLACEHOLDER_RE.sub(
+        lambda match: (
+            '%' if match.group(1) == '%' else '${}'.format(next(counter))),
+        sql,
+    )
+
+
+class PreparedStatements(object):
+    """
+    The statements prepared on a database connection, by SQL, of which
+    the `maxsize` most recently executed ones are kept; the others are
+    deallocated.
+
+    A statement is only prepared the second time it's executed, so that
+    one-off batches (e.g. the last, shorter, batch of an update) are
+    executed as is.
+    """
+
+    def __init__(self, raw_connection, maxsize):
+        # the statements only live as long as the underlying connection
+        self.raw_connection = raw_connection
+        self.maxsize = maxsize
+        # SQL: statement name, or None if it was only executed once
+        self._names = OrderedDict()
+        self._counter = itertools.count(1)
+
+    def execute(self, cursor, sql, parameters):
+        try:
+            name = self._names.pop(sql)
+        except KeyError:
+            cursor.execute(sql, parameters)
+            self._add(cursor, sql, None)
+            return
+
+        if name is None:
+            name = 'bulk_update_{}'.format(next(self._counter))
+            cursor.execute('PREPARE {} AS {}'.format(
+                name, _numbered_placeholders(sql)))
+        self._add(cursor, sql, name)
+
+        cursor.execute(
+            'EXECUTE {}({})'.format(
+                name, ', '.join(itertools.repeat('%s', len(parameters)))),
+            parameters)
+
+    def _add(self, cursor, sql, name):
+        self._names[sql] = name
+        while len(self._names) > self.maxsize:
+            _, evicted = self._names.popitem(last=False)
+            if evicted is not None:
+                cursor.execute('DEALLOCATE {}'.format(evicted))
+
+    def __len__(self):
+        return len(self._names)
+
+
+def get_prepared_statements(connection):
+    """
+    Return the `PreparedStatements` of `connection`, a new one if it
+    (re)connected since.
+    """
+    statements = getattr(connection, '_bulk_update_statements', None)
+    if (statements is None or
+            statements.raw_connection is not connection.connection):
+        statements = PreparedStatements(
+            connection.connection, PREPARED_STATEMENTS_SIZE)
+        connection._bulk_update_statements = statements
+    return statements
+
+
+def _execute(connection, cursor, sql, parameters, plan):
+    if plan is not None and plan.prepare:
+        get_prepared_statements(connection).execute(cursor, sql, parameters)
+    else:
+        cursor.execute(sql, parameters)
+
+
+def _execute_batch(connection, sql, parameters, plan=None, objs=None,
+                   stale=None):
+    """
+    Execute an update and return the number of updated rows. If `plan`
+    returns fields, they are set on the `objs`.
+
+    With a version field, the pks of the `objs` that weren't updated are
+    appended to `stale`.
+    """
+    cursor = connection.cursor()
+
+    if plan is not None and plan.version_field is not None:
+        if not plan.returning:
+            return _execute_versioned_batch(
+                connection, cursor, sql, parameters, plan, objs, stale)
+
+        _execute(connection, cursor, sql, parameters, plan)
+        rows = cursor.fetchall()
+        updated = set(map(id, plan.populate(objs, rows)))
+        stale.extend(_stale_pks(
+            plan, connection, cursor,
+            [obj for obj in objs if id(obj) not in updated]))
+        return len(rows)
+
+    _execute(connection, cursor, sql, parameters, plan)
+
+    if plan is not None and plan.returning:
+        rows = cursor.fetchall()
+        plan.populate(objs, rows)
+        return len(rows)
+
+    return cursor.rowcount
+
+
+def _execute_versioned_batch(connection, cursor, sql, parameters, plan,
+                             objs, stale):
+    """
+    Without RETURNING, lock the rows with the expected versions first, to
+    know which `objs` the update is going to miss.
+    """
+    pks = _collect_column(plan, objs, plan.pk_field, connection)[0]
+    versions = _collect_versions(plan, objs, connection)
+
+    with transaction.atomic(using=plan.using, savepoint=False):
+        cursor.execute(
+            plan.locking_sql(len(pks)),
+            pks + _version_parameters(pks, versions) +
+            list(plan.filter_params))
+        fresh = set(row[0] for row in cursor.fetchall())
+        _execute(connection, cursor, sql, parameters, plan)
+        rowcount = cursor.rowcount
+
+    attname = plan.version_field.attname
+    missed = []
+    for obj, pk in zip(objs, pks):
+        if pk in fresh:
+            setattr(obj, attname, getattr(obj, attname) + 1)
+        else:
+            missed.append(obj)
+    stale.extend(_stale_pks(plan, connection, cursor, missed))
+    return rowcount
+
+
+def _stale_pks(plan, connection, cursor, objs):
+    """
+    Return the pks of `objs`, which weren't updated, whose row doesn't have
+    their version anymore: with a filter, the others only didn't match it.
+    """
+    if not objs or not plan.filter_sql:
+        return [obj.pk for obj in objs]
+
+    pks = _collect_column(plan, objs, plan.pk_field, connection)[0]
+    versions = _collect_versions(plan, objs, connection)
+    cursor.execute(plan.locking_sql(len(pks), filtered=False),
+                   pks + _version_parameters(pks, versions))
+    filtered_out = set(row[0] for row in cursor.fetchall())
+    return [obj.pk for obj, pk in zip(objs, pks) if pk not in filtered_out]
+
+
+def _sort_batch(plan, objs):
+    """
+    Return `objs` sorted by pk, keeping only the last object of each pk,
+    so that concurrent updates lock rows in the same order.
+    """
+    attname = plan.pk_field.attname
+    objs_by_pk = {}
+    for obj in objs:
+        objs_by_pk[getattr(obj, attname)] = obj
+
+    return [
+        objs_by_pk[pk_value]
+        for pk_value in sorted(
+            objs_by_pk, key=lambda pk_value: (pk_value is None, pk_value))
+    ]
+
+
+def _last_per_pk(objs, pk_attname):
+    """
+    Return `objs`, sorted by pk, with only the last object of each pk, so
+    that a pk can't be in two batches updated by different workers: with
+    `atomic`, one would wait for the other's row lock while the other
+    waits for it to vote.
+    """
+    return [
+        obj for obj, next_obj in zip(objs, itertools.chain(objs[1:], [None]))
+        if next_obj is None or
+        getattr(next_obj, pk_attname) != getattr(obj, pk_attname)
+    ]
+
+
+def _refresh_snapshots(objs, fields, stale=None):
+    # stale objects weren't updated, their changes are still to be sent
+    stale = set(stale or ())
+    for obj in objs:
+        if has_snapshot(obj) and obj.pk not in stale:
+            snapshot(obj, fields)
+
+
+def _timed(function, *args):
+    """
+    Return the result of `function(*args)` and how long it took.
+    """
+    start = default_timer()
+    result = function(*args)
+    return result, default_timer() - start
+
+
+def _send_batch_updated(plan, n_rows, fields, sql, parameters, prepare_time,
+                        execute_time, rowcount):
+    # checking the receivers first keeps it (almost) free without any
+    if not signals.batch_updated.has_listeners(plan.meta.model):
+        return
+
+    signals.batch_updated.send(
+        sender=plan.meta.model,
+        using=plan.using,
+        strategy=plan.strategy,
+        rows=n_rows,
+        fields=[field.name for field in fields],
+        params=len(parameters),
+        sql_bytes=len(sql),
+        prepare_time=prepare_time,
+        execute_time=execute_time,
+        rowcount=rowcount,
+    )
+
+
+def _update_batch(plan, objs, connection, fields, stale=None):
+    """
+    Update `fields` of `objs` with one query and return how many rows
+    were updated.
+    """
+    (sql, parameters), prepare_time = _timed(
+        _prepare_batch, plan, objs, connection, fields)
+    rowcount, execute_time = _timed(
+        _execute_batch, connection, sql, parameters, plan, objs, stale)
+    _send_batch_updated(plan, len(objs), fields, sql, parameters,
+                        prepare_time, execute_time, rowcount)
+    return rowcount
+
+
+def _update_batches(plan, batches, connection, refresh=None, stale=None):
+    """
+    Update `(fields, objs)` batches, one after the other, calling
+    `refresh(objs, fields)` after each of them.
+    """
+    rowcount = 0
+    for fields, objs in batches:
+        rowcount += _update_batch(plan, objs, connection, fields, stale)
+        if refresh is not None:
+            refresh(objs, fields)
+    return rowcount
+
+
+class _PipelineError(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _update_batches_pipelined(plan, batches, connection, size,
+                              refresh=None, stale=None):
+    """
+    Update `(fields, objs)` batches, one after the other, while a producer
+    thread prepares the SQL of up to `size` next batches.
+    """
+    prepared = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        # don't block forever if the consumer stopped
+        while not stop.is_set():
+            try:
+                prepared.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def produce():
+        try:
+            for fields, objs in batches:
+                (sql, parameters), prepare_time = _timed(
+                    _prepare_batch, plan, objs, connection, fields)
+                if not put((fields, objs, sql, parameters, prepare_time)):
+                    return
+        except Exception as error:
+            put(_PipelineError(error))
+        else:
+            put(done)
+        finally:
+            # in case deferred fields were loaded from this thread
+            connections[plan.using].close()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+
+    rowcount = 0
+    try:
+        for item in iter(prepared.get, done):
+            if isinstance(item, _PipelineError):
+                raise item.error
+
+            fields, objs, sql, parameters, prepare_time = item
+            count, execute_time = _timed(
+                _execute_batch, connection, sql, parameters, plan, objs,
+                stale)
+            _send_batch_updated(plan, len(objs), fields, sql, parameters,
+                                prepare_time, execute_time, count)
+            rowcount += count
+            if refresh is not None:
+                refresh(objs, fields)
+    finally:
+        stop.set()
+        producer.join()
+
+    return rowcount
+
+
+class _Rollback(Exception):
+    pass
+
+
+class ParallelUpdate(object):
+    """
+    Update `(fields, objs)` batches from `workers` threads, each one with
+    its own connection to the database.
+
+    If `atomic` is False, every batch is committed on its own. Otherwise
+    each thread updates its batches in a transaction and waits for all
+    the others before committing, so that all of them commit or roll back
+    together. As there isn't any two-phase commit though, a thread can
+    still fail to commit after the others did. Threads wait for each other
+    without any timeout, so batches must not share rows (`get_batches`
+    keeps one object per pk): a thread waiting for a row locked by another
+    one, itself waiting for its vote, would hang forever.
+    """
+
+    def __init__(self, plan, batches, workers, atomic=False, refresh=None,
+                 stale=None):
+        self.plan = plan
+        self.batches = iter(batches)
+        self.workers = workers
+        self.atomic = atomic
+        self.refresh = refresh
+        self.stale = stale
+
+        self.rowcount = 0
+        self.errors = []
+        self.failed = False
+        self.pending = workers
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.work) for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+        return self.rowcount
+
+    def next_batch(self):
+        with self.lock:
+            if self.failed or self.errors:
+                return None
+            return next(self.batches, None)
+
+    def update(self, connection):
+        rowcount = 0
+        for batch in iter(self.next_batch, None):
+            count = _update_batches(
+                self.plan, [batch], connection, self.refresh, self.stale)
+            if self.atomic:
+                if self.stale:
+                    # roll every thread back
+                    raise StaleObjectsError(self.stale)
+                rowcount += count
+            else:
+                with self.lock:
+                    self.rowcount += count
+        return rowcount
+
+    def vote(self, failed=False):
+        """
+        Wait for all the threads to be done with their batches, and
+        return whether every one of them succeeded.
+        """
+        with self.finished:
+            self.failed = self.failed or failed
+            self.pending -= 1
+            self.finished.notify_all()
+            while self.pending:
+                self.finished.wait()
+            return not self.failed
+
+    def work_atomic(self, connection):
+        voted = False
+        try:
+            with transaction.atomic(using=self.plan.using):
+                rowcount = self.update(connection)
+                voted = True
+                if not self.vote():
+                    raise _Rollback
+        except Exception:
+            if not voted:
+                self.vote(failed=True)
+            raise
+
+        with self.lock:
+            self.rowcount += rowcount
+
+    def work(self):
+        connection = connections[self.plan.using]
+        try:
+            if self.atomic:
+                self.work_atomic(connection)
+            else:
+                self.update(connection)
+        except _Rollback:
+            pass
+        except Exception as error:
+            with self.lock:
+                self.errors.append(error)
+        finally:
+            connection.close()
+
+
+def get_batches(objs, meta=None, update_fields=None, exclude_fields=None,
+                using='default', batch_size=None, pk_field='pk',
+                strategy='case', max_query_params=None, only_changed=False,
+                sort=False, returning=None, version_field=None,
+                queryset=None, sort_pks=False, prepare=False,
+                pad_batches=False):
+    """
+    Return the `UpdatePlan` and a generator of `(fields, objs)` batches
+    for the arguments of `bulk_update`, or `(None, None)` if there is
+    nothing to update. If `sort` is True, objs are sorted by pk. If
+    `sort_pks` is True, every batch is, and only the last of the objs
+    with the same pk is kept.
+    """
+    assert batch_size is None or batch_size > 0
+    assert max_query_params is None or max_query_params > 0
+
+    connection = connections[using]
+    validate_strategy(strategy, connection)
+    validate_returning(returning, strategy, connection)
+    validate_prepare(prepare, strategy, connection)
+
+    # objs are consumed lazily, batch by batch, so that iterators
+    # (e.g. `queryset.iterator()`) are never fully loaded in memory
+    objs = iter(objs)
+    try:
+        first_obj = next(objs)
+    except StopIteration:
+        return None, None
+    objs = itertools.chain([first_obj], objs)
+
+    validate_version_field(meta or first_obj._meta, version_field, strategy)
+    plan = get_plan(
+        meta or first_obj._meta, update_fields, exclude_fields, pk_field,
+        using, strategy, fields_per_object=meta is None,
+        returning=returning, version_field=version_field,
+    )
+
+    if plan.fields is not None and len(plan.fields) == 0:
+        return None, None
+
+    if queryset is not None:
+        filtered = plan.filtered(queryset)
+        if filtered is None:
+            # like `QuerySet.update`, nothing to update
+            return plan, iter(())
+        plan = filtered
+    if prepare:
+        plan = plan.prepared()
+    if pad_batches:
+        plan = plan.padded(batch_size, max_query_params)
+
+    if sort:
+        pk_attname = plan.pk_field.attname
+        objs = _last_per_pk(
+            sorted(objs, key=lambda obj: getattr(obj, pk_attname)),
+            pk_attname)
+
+    # expressions can have more parameters than batch sizes count
+    limit = None
+    if batch_size is None and plan.strategy != 'copy':
+        limit = _query_params_limit(connection, max_query_params)
+
+    if only_changed or plan.fields is None:
+        batches = _field_batches(
+            plan, objs, batch_size, connection, max_query_params,
+            only_changed)
+    else:
+        if batch_size is None:
+            batch_size = _get_fields_batch_size(
+                plan, connection, len(plan.fields), max_query_params)
+
+        if batch_size is None:
+            # no limit at all, update everything at once
+            objs = list(objs)
+            batch_size = len(objs)
+
+        batches = (
+            (plan.fields, objs_batch)
+            for objs_batch in grouper(objs, batch_size)
+        )
+
+    if limit is not None:
+        batches = _split_expression_batches(plan, batches, connection, limit)
+
+    if sort_pks:
+        batches = (
+            (fields, _sort_batch(plan, objs_batch))
+            for fields, objs_batch in batches
+        )
+
+    return plan, batches
+
+
+def bulk_update(objs, meta=None, update_fields=None, exclude_fields=None,
+                using='default', batch_size=None, pk_field='pk',
+                strategy='case', max_query_params=None, only_changed=False,
+                workers=None, atomic=False, pipeline=0, returning=None,
+                version_field=None, queryset=None, sort_pks=None,
+                prepare=False, pad_batches=False):
+    """
+    Update `objs` and return the number of updated rows.
+
+    If `sort_pks` is True (the default with `workers`), every batch is
+    sorted by pk, so that concurrent updates lock rows in the same order,
+    and objects with the same pk are only updated once, from the last one.
+
+    `returning` names fields whose values, as set by the database, are
+    loaded back into the objects (PostgreSQL and SQLite 3.35+).
+
+    With a `version_field`, rows are only updated if their version is the
+    one of their object, and it's incremented. Objects whose row had
+    another version are reported by a `StaleObjectsError`, raised once
+    the others were updated (or, if `atomic`, rolling them back).
+
+    If `queryset` is given, only the rows matching its filters are updated.
+
+    If `prepare` is True (PostgreSQL only), batches with the same SQL are
+    executed as a statement prepared once per connection, to save the
+    server parsing and planning each of them, see `PreparedStatements`.
+
+    If `pad_batches` is True, batches are padded up to a power of two
+    rows (but not above the batch size) so that only a few different
+    statements are sent, at the cost of some extra parameters.
+    """
+    assert workers is None or workers > 0
+    assert pipeline >= 0
+    assert not (workers and pipeline), "Can't pipeline parallel updates"
+    assert strategy != 'copy' or not (workers or pipeline), (
+        "The 'copy' strategy can't be used with workers or pipeline")
+
+    # With workers, batches are dispatched in pk order, so that concurrent
+    # updates lock rows in the same order and can't deadlock each other.
+    plan, batches = get_batches(
+        objs, meta=meta, update_fields=update_fields,
+        exclude_fields=exclude_fields, using=using, batch_size=batch_size,
+        pk_field=pk_field, strategy=strategy,
+        max_query_params=max_query_params, only_changed=only_changed,
+        sort=bool(workers), returning=returning, version_field=version_field,
+        queryset=queryset,
+        sort_pks=bool(workers) if sort_pks is None else sort_pks,
+        prepare=prepare, pad_batches=pad_batches,
+    )
+    if plan is None:
+        return
+
+    stale = [] if version_field is not None else None
+
+    # Snapshots are only refreshed once their batches are committed: with
+    # `atomic`, a rollback must leave the objects as changed as they were.
+    committed = []
+    if not only_changed:
+        refresh = None
+    elif atomic:
+        def refresh(objs, fields):
+            committed.append((objs, fields))
+    else:
+        refresh = functools.partial(_refresh_snapshots, stale=stale)
+
+    if workers:
+        rowcount = ParallelUpdate(
+            plan, batches, workers, atomic, refresh, stale).run()
+        if stale:
+            raise StaleObjectsError(stale, rowcount)
+        for objs, fields in committed:
+            _refresh_snapshots(objs, fields)
+        return rowcount
+
+    connection = connections[using]
+    if strategy == 'copy':
+        update_batches = _update_batches_copy
+    elif pipeline:
+        update_batches = functools.partial(
+            _update_batches_pipelined, size=pipeline, stale=stale)
+    else:
+        update_batches = functools.partial(_update_batches, stale=stale)
+
+    def update():
+        rowcount = update_batches(plan, batches, connection,
+                                  refresh=refresh)
+        if stale:
+            raise StaleObjectsError(stale, rowcount)
+        return rowcount
+
+    if not atomic:
+        return update()
+
+    with transaction.atomic(using=using):
+        rowcount = update()
+    for objs, fields in committed:
+        _refresh_snapshots(objs, fields)
+    return rowcount
+
+
+def bulk_update_values(model, pks, values, using='default', batch_size=None,
+                       pk_field='pk', strategy='case', max_query_params=None,
+                       queryset=None, prepare=False, pad_batches=False):
+    """
+    Update the rows of `model` whose pk (or `pk_field`) is in `pks`, from
+    columns of values instead of model instances: `values` maps field
+    names to sequences (lists, numpy arrays...) of values, one per pk.
+
+    If `queryset` is given, only the rows matching its filters are updated,
+    and `prepare` and `pad_batches` are the same as `bulk_update`'s.
+
+    Return the number of updated rows.
+    """
+    assert batch_size is None or batch_size > 0
+    assert max_query_params is None or max_query_params > 0
+
+    connection = connections[using]
+    validate_strategy(strategy, connection)
+    validate_prepare(prepare, strategy, connection)
+
+    n_pks = len(pks)
+    for name, column in values.items():
+        if len(column) != n_pks:
+            raise ValueError(
+                "{} values for {} pks in {!r}".format(
+                    len(column), n_pks, name)
+            )
+
+    if not n_pks or not values:
+        return
+
+    plan = get_plan(model._meta, list(values.keys()), pk_field=pk_field,
+                    using=using, strategy=strategy)
+    if queryset is not None:
+        plan = plan.filtered(queryset)
+        if plan is None:
+            # like `QuerySet.update`, nothing to update
+            return 0
+    if prepare:
+        plan = plan.prepared()
+    if pad_batches:
+        plan = plan.padded(batch_size, max_query_params)
+    fields = plan.fields
+
+    pks, _ = _prepare_column(plan.pk_field, pks, plan, connection)
+    columns = []
+    placeholders = []
+    for field in fields:
+        column = values[field.name if field.name in values else field.attname]
+        column, field_placeholders = _prepare_column(
+            field, column, plan, connection)
+        columns.append(column)
+        placeholders.append(field_placeholders)
+
+    row_params = limit = None
+    if batch_size is None:
+        batch_size = _get_fields_batch_size(
+            plan, connection, len(fields), max_query_params) or n_pks
+        if strategy != 'copy':
+            limit = _query_params_limit(connection, max_query_params)
+            row_params = _row_params(plan, columns, placeholders)
+
+    if row_params is not None and limit is not None:
+        # expressions have more parameters than the batch size counts
+        slices = _split_rows(row_params, limit - len(plan.filter_params))
+    else:
+        slices = (
+            (start, start + batch_size)
+            for start in range(0, n_pks, batch_size)
+        )
+
+    batches = (
+        (
+            fields, pks[start:end],
+            [column[start:end] for column in columns],
+            [
+                None if field_placeholders is None
+                else field_placeholders[start:end]
+                for field_placeholders in placeholders
+            ],
+        )
+        for start, end in slices
+    )
+
+    if strategy == 'copy':
+        return _copy_update(plan, connection, batches)
+
+    rowcount = 0
+    for batch in batches:
+        (sql, parameters), prepare_time = _timed(_batch_sql, plan, *batch)
+        count, execute_time = _timed(
+            _execute_batch, connection, sql, parameters, plan)
+        _send_batch_updated(plan, len(batch[1]), fields, sql, parameters,
+                            prepare_time, execute_time, count)
+        rowcount += count
+    return rowcount
+
+
+UpsertResult = namedtuple('UpsertResult', ['inserted', 'updated'])
+
+
+def _get_conflict_fields(meta, conflict_fields):
+    if conflict_fields is None:
+        return [meta.pk]
+
+    pk_names = ('pk', meta.pk.name, meta.pk.attname)
+    validate_fields(meta, [
+        name for name in conflict_fields if name not in pk_names])
+    return [
+        meta.pk if name in pk_names else meta.get_field(name)
+        for name in conflict_fields
+    ]
+
+
+class UpsertPlan(object):
+    """
+    Like `UpdatePlan`, for `bulk_upsert`: the fields to insert and update
+    and the vendor-specific ``INSERT ... ON CONFLICT`` statement.
+    """
+
+    def __init__(self, meta, update_fields, conflict_fields, connection):
+        self.meta = meta
+        self.vendor = connection.vendor
+
+        if self.vendor not in ('postgresql', 'sqlite', 'mysql'):
+            raise ValueError(
+                "bulk_upsert isn't supported by {}".format(self.vendor))
+        if self.vendor == 'sqlite':
+            version_info = connection.Database.sqlite_version_info
+            if version_info < (3, 24):
+                raise ValueError(
+                    "bulk_upsert needs SQLite 3.24+ (ON CONFLICT), "
+                    "not {}".format('.'.join(map(str, version_info))))
+
+        self.conflict_fields = _get_conflict_fields(meta, conflict_fields)
+        exclude_fields = [
+            field.attname for field in self.conflict_fields
+            if not field.primary_key
+        ]
+        if update_fields is None:
+            # rows keep the time they were created at
+            exclude_fields.extend(
+                field.attname for field in meta.concrete_fields
+                if getattr(field, 'auto_now_add', False))
+        self.update_fields = get_fields(update_fields, exclude_fields, meta)
+        if not self.update_fields:
+            raise ValueError('bulk_upsert needs at least one field to update')
+
+        # Auto-incremented pks are only inserted when they are set
+        self.auto_pk = isinstance(meta.pk, models.AutoField)
+
+        self.qn = qn = connection.ops.quote_name
+        self.dbtable = qn(meta.db_table)
+
+    def get_fields(self, with_pk):
+        return [
+            field for field in self.meta.concrete_fields
+            if with_pk or not (field.primary_key and self.auto_pk)
+        ]
+
+    def insert_sql(self, fields, rows):
+        """
+        Return the upsert statement of `fields` for the given rows of
+        placeholders.
+        """
+        qn = self.qn
+        sql = 'INSERT INTO {dbtable} ({columns}) VALUES {rows}'.format(
+            dbtable=self.dbtable,
+            columns=', '.join(qn(field.column) for field in fields),
+            rows=', '.join(
+                '({})'.format(', '.join(row)) for row in rows),
+        )
+
+        if self.vendor == 'mysql':
+            # any unique key of the table conflicts
+            return sql + ' ON DUPLICATE KEY UPDATE {}'.format(', '.join(
+                '{column} = VALUES({column})'.format(column=qn(field.column))
+                for field in self.update_fields
+            ))
+
+        sql += ' ON CONFLICT ({}) DO UPDATE SET {}'.format(
+            ', '.join(qn(field.column) for field in self.conflict_fields),
+            ', '.join(
+                '{column} = EXCLUDED.{column}'.format(
+                    column=qn(field.column))
+                for field in self.update_fields
+            ),
+        )
+
+        if self.vendor == 'postgresql':
+            # xmax is only 0 for rows that didn't exist
+            sql += ' RETURNING {}, (xmax = 0)'.format(qn(self.meta.pk.column))
+
+        return sql
+
+    def count_sql(self, n_objs):
+        """
+        Return a query counting the `n_objs` existing rows by their
+        conflict fields.
+        """
+        qn = self.qn
+        condition = '({})'.format(' AND '.join(
+            '{} = %s'.format(qn(field.column))
+            for field in self.conflict_fields
+        ))
+        return 'SELECT COUNT(*) FROM {dbtable} WHERE {conditions}'.format(
+            dbtable=self.dbtable,
+            conditions=' OR '.join(itertools.repeat(condition, n_objs)),
+        )
+
+
+def _upsert_batch(plan, objs, connection, using):
+    """
+    Upsert `objs`, all with or all without a pk, and return an
+    `UpsertResult` of their counts.
+    """
+    pk_attname = plan.meta.pk.attname
+    fields = plan.get_fields(
+        with_pk=getattr(objs[0], pk_attname) is not None)
+    compiler = InsertQuery(plan.meta.model).get_compiler(
+        connection=connection)
+
+    rows = []
+    parameters = []
+    for obj in objs:
+        row = []
+        for field in fields:
+            # `auto_now_add` fields of objects that have one are left as is
+            add = (not getattr(field, 'auto_now_add', False) or
+                   getattr(obj, field.attname) is None)
+            value, placeholder = _value_as_sql(
+                field.pre_save(obj, add), field, compiler.query, compiler,
+                connection)
+            row.append(placeholder)
+            if isinstance(value, tuple):
+                parameters.extend(value)
+            else:
+                parameters.append(value)
+        rows.append(row)
+
+    sql = plan.insert_sql(fields, rows)
+    n_objs = len(objs)
+
+    with transaction.atomic(using=using, savepoint=False):
+        cursor = connection.cursor()
+
+        if plan.vendor == 'sqlite':
+            cursor.execute(plan.count_sql(n_objs), [
+                field.get_db_prep_save(
+                    getattr(obj, field.attname), connection=connection)
+                for obj in objs
+                for field in plan.conflict_fields
+            ])
+            updated = cursor.fetchone()[0]
+            cursor.execute(sql, parameters)
+            inserted = n_objs - updated
+
+        elif plan.vendor == 'postgresql':
+            cursor.execute(sql, parameters)
+            inserted = 0
+            for obj, (pk, row_inserted) in zip(objs, cursor.fetchall()):
+                setattr(obj, pk_attname, pk)
+                inserted += row_inserted
+            updated = n_objs - inserted
+
+        else:
+            # MySQL counts 1 affected row per insert and 2 per update, but
+            # 1 for rows that already had the new values (Django connects
+            # with CLIENT_FOUND_ROWS), which are then counted as inserted.
+            cursor.execute(sql, parameters)
+            updated = max(cursor.rowcount - n_objs, 0)
+            inserted = n_objs - updated
+
+    for obj in objs:
+        # objects inserted without a pk (but on PostgreSQL) don't know
+        # their row, saving them would insert another one
+        if getattr(obj, pk_attname) is not None:
+            obj._state.adding = False
+        obj._state.db = using
+
+    return UpsertResult(inserted, updated)
+
+
+def bulk_upsert(objs, meta=None, update_fields=None, conflict_fields=None,
+                using='default', batch_size=None, max_query_params=None):
+    """
+    Insert `objs`, or update the `update_fields` (by default all of them
+    but the conflict fields) of the rows they conflict with on
+    `conflict_fields` (by default the pk; any unique key on MySQL), with
+    ``INSERT ... ON CONFLICT DO UPDATE`` (``ON DUPLICATE KEY UPDATE`` on
+    MySQL).
+
+    Return an `UpsertResult` of the number of inserted and updated rows.
+    """
+    assert batch_size is None or batch_size > 0
+    assert max_query_params is None or max_query_params > 0
+
+    connection = connections[using]
+
+    objs = iter(objs)
+    try:
+        first_obj = next(objs)
+    except StopIteration:
+        return UpsertResult(0, 0)
+    objs = itertools.chain([first_obj], objs)
+
+    plan = UpsertPlan(meta or first_obj._meta, update_fields,
+                      conflict_fields, connection)
+
+    if batch_size is None:
+        batch_size = get_batch_size(
+            connection, len(plan.get_fields(with_pk=True)), max_query_params)
+
+    if batch_size is None:
+        objs = list(objs)
+        batch_size = len(objs)
+
+    pk_attname = plan.meta.pk.attname
+    inserted = updated = 0
+    for batch in grouper(objs, batch_size):
+        # objs without pk don't insert it
+        for _, batch_objs in itertools.groupby(
+            sorted(batch, key=lambda obj: getattr(obj, pk_attname) is None),
+            key=lambda obj: getattr(obj, pk_attname) is None,
+        ):
+            result = _upsert_batch(
+                plan, list(batch_objs), connection, using)
+            inserted += result.inserted
+            updated += result.updated
+
+    return UpsertResult(inserted, updated)
+
+
+def abulk_update(objs, **kwargs):
+    """
+    Coroutine version of `bulk_update`, see `django_bulk_update.aio`
+    (python 3.5+).
+    """
+    from .aio import abulk_update
+
+    return abulk_update(objs, **kwargs)
@@ -1,16 +1,78 @@
 from django.db import models
-from .helper import bulk_update
+from .helper import (
+    abulk_update, bulk_update, bulk_update_values, bulk_upsert,
+)
 
 
 class BulkUpdateQuerySet(models.QuerySet):
 
     def bulk_update(self, objs, update_fields=None,
-                    exclude_fields=None, batch_size=None, pk_field='pk'):
+                    exclude_fields=None, batch_size=None, pk_field='pk',
+                    strategy='case', max_query_params=None,
+                    only_changed=False, workers=None, atomic=False,
+                    pipeline=0, returning=None, version_field=None,
+                    sort_pks=None, prepare=False, pad_batches=False):
 
+        assert self.query.can_filter(), \
+            "Cannot update a query once a slice has been taken."
         self._for_write = True
         using = self.db
 
         return bulk_update(
             objs, update_fields=update_fields,
             exclude_fields=exclude_fields, using=using,
-            batch_size=batch_size, pk_field=pk_field)
+            batch_size=batch_size, pk_field=pk_field, strategy=strategy,
+            max_query_params=max_query_params, only_changed=only_changed,
+            workers=workers, atomic=atomic, pipeline=pipeline,
+            returning=returning, version_field=version_field,
+            queryset=self, sort_pks=sort_pks, prepare=prepare,
+            pad_batches=pad_batches)
+
+    def bulk_update_values(self, pks, values, batch_size=None, pk_field='pk',
+                           strategy='case', max_query_params=None,
+                           prepare=False, pad_batches=False):
+
+        assert self.query.can_filter(), \
+            "Cannot update a query once a slice has been taken."
+        self._for_write = True
+        using = self.db
+
+        return bulk_update_values(
+            self.model, pks, values, using=using, batch_size=batch_size,
+            pk_field=pk_field, strategy=strategy,
+            max_query_params=max_query_params, queryset=self,
+            prepare=prepare, pad_batches=pad_batches)
+
+    def bulk_upsert(self, objs, update_fields=None, conflict_fields=None,
+                    batch_size=None, max_query_params=None):
+
+        self._for_write = True
+        using = self.db
+
+        return bulk_upsert(
+            objs, update_fields=update_fields,
+            conflict_fields=conflict_fields, using=using,
+            batch_size=batch_size, max_query_params=max_query_params)
+
+    def abulk_update(self, objs, update_fields=None,
+                     exclude_fields=None, batch_size=None, pk_field='pk',
+                     strategy='case', max_query_params=None,
+                     only_changed=False, returning=None,
+                     version_field=None, sort_pks=False, prepare=False,
+                     pad_batches=False):
+        """
+        Coroutine version of `bulk_update` (python 3.5+).
+        """
+        assert self.query.can_filter(), \
+            "Cannot update a query once a slice has been taken."
+        self._for_write = True
+        using = self.db
+
+        return abulk_update(
+            objs, update_fields=update_fields,
+            exclude_fields=exclude_fields, using=using,
+            batch_size=batch_size, pk_field=pk_field, strategy=strategy,
+            max_query_params=max_query_params, only_changed=only_changed,
+            returning=returning, version_field=version_field,
+            queryset=self, sort_pks=sort_pks, prepare=prepare,
+            pad_batches=pad_batches)
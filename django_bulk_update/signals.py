@@ -0,0 +1,16 @@
+from django.dispatch import Signal
+
+# Sent after every batch of `bulk_update` (but the 'copy' strategy's) and
+# `bulk_update_values`, with the model as sender and the arguments:
+#   using: the database alias
+#   strategy: the plan's strategy
+#   rows: the number of objects (or pks) of the batch
+#   fields: the names of the updated fields
+#   params: the number of query parameters
+#   sql_bytes: the length of the SQL statement
+#   prepare_time: seconds spent preparing the values and the SQL
+#   execute_time: seconds spent executing the query
+#   rowcount: the number of updated rows
+#
+# Nothing is built nor sent while no receiver is connected.
+batch_updated = Signal()
@@ -0,0 +1,86 @@
+"""
+Opt-in tracking of the values loaded from the db, so that
+``bulk_update(..., only_changed=True)`` only sends the changed fields
+and skips the unchanged objects.
+"""
+import copy
+
+SNAPSHOT_ATTR = '_bulk_update_snapshot'
+
+
+def snapshot(obj, fields=None):
+    """
+    Record the current values of `fields` of `obj`; by default, of all its
+    concrete fields that are not deferred.
+    """
+    if fields is None:
+        deferred_fields = obj.get_deferred_fields()
+        fields = [
+            field
+            for field in obj._meta.concrete_fields
+            if field.attname not in deferred_fields
+        ]
+
+    values = obj.__dict__.setdefault(SNAPSHOT_ATTR, {})
+    for field in fields:
+        # copied, so that in-place changes of mutable values
+        # (e.g. a JSONField's dict) are detected
+        values[field.attname] = copy.deepcopy(getattr(obj, field.attname))
+
+
+def has_snapshot(obj):
+    return SNAPSHOT_ATTR in obj.__dict__
+
+
+def get_changed_fields(obj, fields):
+    """
+    Return the ones of `fields` whose value differs from the snapshot of
+    `obj`, or all of them if there is no snapshot.
+    """
+    values = obj.__dict__.get(SNAPSHOT_ATTR)
+    if values is None:
+        return fields
+
+    missing = object()
+    changed_fields = []
+    for field in fields:
+        value = getattr(obj, field.attname)
+        if (
+            hasattr(value, 'resolve_expression') or
+            values.get(field.attname, missing) != value
+        ):
+            changed_fields.append(field)
+
+    return changed_fields
+
+
+class TrackChangesMixin(object):
+    """
+    Model mixin that takes a snapshot of every instance loaded from the db
+    or saved, to be used with ``bulk_update(..., only_changed=True)``:
+
+        class Person(TrackChangesMixin, models.Model):
+            ...
+            objects = BulkUpdateManager()
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super(TrackChangesMixin, cls).from_db(db, field_names, values)
+        snapshot(obj)
+        return obj
+
+    def save(self, *args, **kwargs):
+        super(TrackChangesMixin, self).save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            snapshot(self)
+        else:
+            # the other fields weren't written
+            update_fields = set(update_fields)
+            snapshot(self, [
+                field for field in self._meta.concrete_fields
+                if field.name in update_fields or
+                field.attname in update_fields
+            ])
@@ -22,7 +22,7 @@ if sys.argv[-1] == 'tag':
 setup(
     name='django-bulk-update',
     version=version,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     install_requires=[
         'Django>=1.8',
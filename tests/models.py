@@ -5,6 +5,7 @@ from jsonfield import JSONField
 from uuid import uuid4
 
 from django_bulk_update.manager import BulkUpdateManager
+from django_bulk_update.tracking import TrackChangesMixin
 
 
 class Role(models.Model):
@@ -73,3 +74,26 @@ class Brand(models.Model):
         codes = ArrayField(models.CharField(max_length=64), default=['code_1'])
 
     objects = BulkUpdateManager()
+
+
+class TrackedPerson(TrackChangesMixin, models.Model):
+    name = models.CharField(max_length=140)
+    age = models.IntegerField()
+    data = JSONField(null=True, blank=True)
+
+    objects = BulkUpdateManager()
+
+
+class VersionedPerson(models.Model):
+    name = models.CharField(max_length=140)
+    age = models.IntegerField()
+    version = models.IntegerField(default=0)
+
+    objects = BulkUpdateManager()
+
+
+class TimestampedPerson(models.Model):
+    name = models.CharField(max_length=140)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = BulkUpdateManager()
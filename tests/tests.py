@@ -1,18 +1,29 @@
 import random
+import sys
+import threading
+import warnings
 
-from datetime import date, time, timedelta
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 from unittest import skipUnless
+from uuid import uuid4
 
 from django.conf import settings
+from django.db import IntegrityError, connection, connections
 from django.db.models import F, Func, Value
 from django.db.models.functions import Concat
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 
 from django_bulk_update import helper
 
-from .models import Person, Role, PersonUUID, Brand
+from django_bulk_update import signals, tracking
+
+from .models import (
+    Person, Role, PersonUUID, Brand, TimestampedPerson, TrackedPerson,
+    VersionedPerson,
+)
 from .fixtures import create_fixtures
 
 
@@ -311,6 +322,41 @@ class BulkUpdateTests(TestCase):
         for idx, person in enumerate(people):
             self.assertEqual(person.big_age, idx + 27)
 
+    def test_iterator(self):
+        """
+        Pass in an iterator, which is consumed batch by batch.
+        """
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.big_age = idx + 27
+
+        with CaptureQueriesContext(connection) as ctx:
+            queries = []
+
+            def generate():
+                for person in people:
+                    queries.append(len(ctx.captured_queries))
+                    yield person
+
+            count = Person.objects.bulk_update(generate(), batch_size=2)
+
+        self.assertEqual(count, 6)
+        self.assertEqual(queries, [0, 0, 1, 1, 2, 2])
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.big_age, idx + 27)
+
+    def test_queryset_iterator(self):
+        def set_age(people):
+            for person in people:
+                person.age = 11
+                yield person
+
+        people = Person.objects.order_by('pk').iterator()
+        Person.objects.bulk_update(set_age(people), update_fields=['age'])
+        self.assertEqual(Person.objects.filter(age=11).count(), 6)
+
     def test_empty_list(self):
         """
         Update no elements, passed as a list
@@ -443,6 +489,23 @@ class BulkUpdateTests(TestCase):
             expected_value = idx*10 - idx
             self.assertEqual(saved_value, expected_value)
 
+    def test_Value_expression(self):
+        people = list(Person.objects.order_by('pk'))
+        for idx, person in enumerate(people):
+            person.age = Value(7 + idx % 2)
+
+        Person.objects.bulk_update(people, update_fields=['age'])
+
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [7 + idx % 2 for idx in range(len(people))])
+
+        pks = [person.pk for person in people]
+        helper.bulk_update_values(Person, pks, {'age': [Value(3)] * len(pks)})
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [3] * len(pks))
+
     def test_Func_expresion(self):
 
         # initialize
@@ -633,6 +696,27 @@ class NumQueriesTest(TestCase):
         people = people1 | people2
         self.assertNumQueries(2, Person.objects.bulk_update, people)
 
+    def test_different_deferred_fields_in_a_list(self):
+        """
+        Queries:
+            - update objects * 2
+
+        (one query per set of deferred fields)
+        """
+        people = (
+            list(Person.objects.filter(age__lt=10).only('name')) +
+            list(Person.objects.filter(age__gte=10).only('text'))
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            Person.objects.bulk_update(people)
+
+        self.assertEqual(len(ctx.captured_queries), 2)
+        sqls = sorted(query['sql'] for query in ctx.captured_queries)
+        self.assertIn('"name"', sqls[0])
+        self.assertNotIn('"text"', sqls[0])
+        self.assertIn('"text"', sqls[1])
+        self.assertNotIn('"name"', sqls[1])
+
     def test_deferred_fields_and_excluded_fields(self):
         """
         Queries:
@@ -697,6 +781,121 @@ class NumQueriesTest(TestCase):
         self.assertNumQueries(4, Person.objects.bulk_update,
                               people, batch_size=2)
 
+    def test_max_query_params(self):
+        """
+        Queries:
+            - retrieve objects
+            - update objects * 3
+
+        (1 pk + 2 fields * 2 parameters per object, at most 10 parameters)
+        """
+        people = Person.objects.order_by('pk').all()
+        self.assertNumQueries(4, Person.objects.bulk_update,
+                              people, update_fields=['age', 'name'],
+                              max_query_params=10)
+
+
+class BatchSizeTests(TestCase):
+
+    def test_get_batch_size(self):
+        limit = helper.get_batch_size(connection, 1)
+        if limit is not None:
+            self.assertEqual(helper.get_batch_size(connection, 5), limit // 5)
+        self.assertEqual(helper.get_batch_size(connection, 7, 50), 7)
+        self.assertEqual(helper.get_batch_size(connection, 70, 50), 1)
+
+    def test_sqlite_limit(self):
+        if connection.vendor == 'sqlite':
+            self.assertEqual(helper.get_batch_size(connection, 49), 20)
+
+    def test_automatic_batch_size(self):
+        """
+        More objects than the backend can bind in a single query.
+        """
+        create_fixtures(1000)
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = idx
+            person.name = 'name %s' % idx
+        count = Person.objects.bulk_update(people)
+        self.assertEqual(count, 1000)
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx)
+            self.assertEqual(person.name, 'name %s' % idx)
+
+    def test_filter_parameters(self):
+        create_fixtures(10)
+        people = list(Person.objects.order_by('pk'))
+        for person in people:
+            person.age += 1
+        params = []
+
+        def receiver(sender, **kwargs):
+            params.append(kwargs['params'])
+
+        signals.batch_updated.connect(receiver, sender=Person)
+        try:
+            count = Person.objects.filter(
+                pk__gt=0, age__lt=10 ** 6,
+            ).bulk_update(people, update_fields=['age', 'name'],
+                          max_query_params=10)
+        finally:
+            signals.batch_updated.disconnect(receiver, sender=Person)
+
+        self.assertEqual(count, 10)
+        self.assertEqual(params, [7] * 10)
+
+    def _expression_params(self, update, *args, **kwargs):
+        params = []
+
+        def receiver(sender, **kwargs):
+            params.append(kwargs['params'])
+
+        signals.batch_updated.connect(receiver, sender=Person)
+        try:
+            count = update(*args, **kwargs)
+        finally:
+            signals.batch_updated.disconnect(receiver, sender=Person)
+        return count, params
+
+    def test_expression_parameters(self):
+        create_fixtures(10)
+        people = list(Person.objects.order_by('pk'))
+        ages = [person.age for person in people]
+        for idx, person in enumerate(people):
+            person.age = F('age') + idx + 2 * idx + 3
+
+        strategies = ['case']
+        if connection.vendor == 'postgresql':
+            strategies.append('values')
+        for strategy in strategies:
+            count, params = self._expression_params(
+                Person.objects.bulk_update, people,
+                update_fields=['age', 'name'], strategy=strategy,
+                max_query_params=30)
+
+            self.assertEqual(count, 10)
+            # batches of 6 objects, split by 4 ones of 7 parameters
+            self.assertEqual(params, [28, 14, 28])
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [age + 3 * idx + 3 for idx, age in enumerate(ages)])
+
+    def test_bulk_update_values_expression_parameters(self):
+        create_fixtures(10)
+        pks = list(Person.objects.order_by('pk').values_list('pk', flat=True))
+
+        count, params = self._expression_params(
+            Person.objects.bulk_update_values, pks, {
+                'age': [F('age') + idx + 2 * idx + 3 for idx in range(10)],
+                'name': ['name %s' % idx for idx in range(10)],
+            }, max_query_params=30)
+
+        self.assertEqual(count, 10)
+        self.assertEqual(params, [28, 28, 14])
+
 
 class GetFieldsTests(TestCase):
 
@@ -888,3 +1087,1688 @@ class GetFieldsTests(TestCase):
         exclude_fields = ['jobs']
         self.assertRaises(TypeError, helper.get_fields,
                           update_fields, exclude_fields, meta)
+
+
+class StrategyTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+
+    def test_unknown_strategy(self):
+        people = Person.objects.all()
+        self.assertRaises(ValueError, Person.objects.bulk_update,
+                          people, strategy='merge')
+
+    @skipUnless(settings.DATABASES['default']['USER'] != 'postgres',
+                "The 'values' strategy is supported by PostgreSQL.")
+    def test_values_strategy_not_supported(self):
+        people = Person.objects.all()
+        self.assertRaises(ValueError, Person.objects.bulk_update,
+                          people, strategy='values')
+
+    def test_values_sql(self):
+        meta = Person._meta
+        plan = helper.get_plan(meta, update_fields=['age', 'name'],
+                               strategy='values')
+
+        sql = plan.values_sql(plan.fields, 2)
+
+        self.assertTrue(sql.startswith(
+            'UPDATE "tests_person" SET '
+            '"age" = "bulk_update_values"."age", '
+            '"name" = "bulk_update_values"."name" FROM (VALUES '))
+        self.assertTrue(sql.endswith(
+            'AS "bulk_update_values" ("id", "age", "name") '
+            'WHERE "tests_person"."id" = "bulk_update_values"."id"'))
+        self.assertEqual(sql.count('CAST(%s AS '), 6)
+
+    @skipUnless(settings.DATABASES['default']['USER'] == 'postgres',
+                "The 'values' strategy is only available in PostgreSQL.")
+    def test_values_strategy(self):
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = idx + 27
+            person.name = 'name %s' % idx
+            person.date_time = None
+        Person.objects.bulk_update(people, strategy='values')
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx + 27)
+            self.assertEqual(person.name, 'name %s' % idx)
+            self.assertEqual(person.date_time, None)
+
+    @skipUnless(settings.DATABASES['default']['USER'] == 'postgres',
+                "The 'values' strategy is only available in PostgreSQL.")
+    def test_values_strategy_with_expressions(self):
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = idx * 10
+            person.save()
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = F('age') - idx
+        Person.objects.bulk_update(people, update_fields=['age'],
+                                   strategy='values')
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx * 10 - idx)
+
+    @skipUnless(settings.DATABASES['default']['USER'] != 'postgres',
+                "The 'copy' strategy is supported by PostgreSQL.")
+    def test_copy_strategy_not_supported(self):
+        people = Person.objects.all()
+        self.assertRaises(ValueError, Person.objects.bulk_update,
+                          people, strategy='copy')
+
+    def test_copy_sql(self):
+        meta = Person._meta
+        plan = helper.get_plan(meta, update_fields=['age', 'name'],
+                               strategy='copy')
+
+        create, copy, update, drop = plan.copy_sql(plan.fields, 0)
+
+        self.assertTrue(create.startswith(
+            'CREATE TEMPORARY TABLE "bulk_update_copy_0" ("id" '))
+        self.assertEqual(copy, 'COPY "bulk_update_copy_0" FROM STDIN')
+        self.assertEqual(
+            update,
+            'UPDATE "tests_person" SET '
+            '"age" = "bulk_update_copy_0"."age", '
+            '"name" = "bulk_update_copy_0"."name" '
+            'FROM "bulk_update_copy_0" '
+            'WHERE "tests_person"."id" = "bulk_update_copy_0"."id"')
+        self.assertEqual(drop, 'DROP TABLE "bulk_update_copy_0"')
+
+    def test_copy_text(self):
+        self.assertEqual(helper._copy_text(None), '\\N')
+        self.assertEqual(helper._copy_text(True), 't')
+        self.assertEqual(helper._copy_text(12), '12')
+        self.assertEqual(helper._copy_text('a\tb\nc\\'), 'a\\tb\\nc\\\\')
+        self.assertEqual(helper._copy_text(date(2016, 1, 2)),
+                         '2016-01-02')
+        self.assertEqual(helper._copy_text(['a', None, 'b"']),
+                         '{"a",NULL,"b\\\\""}')
+        self.assertEqual(
+            helper._copy_text(connection.Database.Binary(b'\x01\xff')),
+            '\\\\x01ff')
+
+    def test_copy_text_binary_adapter(self):
+        try:
+            from psycopg2 import Binary
+        except ImportError:
+            self.skipTest('psycopg2 is not installed')
+
+        # what BinaryField.get_db_prep_value returns on PostgreSQL
+        self.assertEqual(helper._copy_text(Binary(b'\x01\xff')),
+                         '\\\\x01ff')
+
+    @skipUnless(settings.DATABASES['default']['USER'] == 'postgres',
+                "The 'copy' strategy is only available in PostgreSQL.")
+    def test_copy_strategy(self):
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = idx + 27
+            person.name = 'name\t%s' % idx
+            person.date_time = None
+        Person.objects.bulk_update(people, strategy='copy', batch_size=3)
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx + 27)
+            self.assertEqual(person.name, 'name\t%s' % idx)
+            self.assertEqual(person.date_time, None)
+
+    @skipUnless(settings.DATABASES['default']['USER'] == 'postgres',
+                "The 'copy' strategy is only available in PostgreSQL.")
+    def test_copy_strategy_with_expressions(self):
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = F('age') + idx
+            person.name = 'name %s' % idx
+        ages = list(Person.objects.order_by('pk').values_list('age', flat=True))
+        Person.objects.bulk_update(people, update_fields=['age', 'name'],
+                                   strategy='copy')
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, ages[idx] + idx)
+            self.assertEqual(person.name, 'name %s' % idx)
+
+    @skipUnless(connection.vendor != 'mysql',
+                "The 'join' strategy is supported by MySQL.")
+    def test_join_strategy_not_supported(self):
+        people = Person.objects.all()
+        self.assertRaises(ValueError, Person.objects.bulk_update,
+                          people, strategy='join')
+
+    def test_join_sql(self):
+        meta = Person._meta
+        plan = helper.get_plan(meta, update_fields=['age', 'name'],
+                               strategy='join')
+        qn = connection.ops.quote_name
+
+        sql = plan.join_sql(plan.fields, 3)
+
+        self.assertEqual(
+            sql,
+            'UPDATE {table} JOIN (SELECT %s AS {id}, %s AS {age}, '
+            '%s AS {name} UNION ALL SELECT %s, %s, %s '
+            'UNION ALL SELECT %s, %s, %s) AS {alias} USING ({id}) '
+            'SET {table}.{age} = {alias}.{age}, '
+            '{table}.{name} = {alias}.{name}'.format(
+                table=qn('tests_person'), id=qn('id'), age=qn('age'),
+                name=qn('name'), alias=qn('bulk_update_values'))
+        )
+
+    def test_identifiers_quoted_by_the_database(self):
+        plan = helper.get_plan(Person._meta, update_fields=['age'])
+        qn = connection.ops.quote_name
+
+        self.assertEqual(plan.dbtable, qn('tests_person'))
+        self.assertTrue(plan.case_sql(plan.fields[0], 1).startswith(
+            '{} = '.format(qn('age'))))
+        self.assertEqual(plan.in_clause(2), '{} in (%s, %s)'.format(qn('id')))
+
+    @skipUnless(connection.vendor == 'mysql',
+                "The 'join' strategy is only available in MySQL.")
+    def test_join_strategy(self):
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = idx + 27
+            person.name = 'name "%s"' % idx
+            person.date_time = None
+        Person.objects.bulk_update(people, strategy='join')
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx + 27)
+            self.assertEqual(person.name, 'name "%s"' % idx)
+            self.assertEqual(person.date_time, None)
+
+
+class PlanCacheTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        helper.clear_plan_cache()
+
+    def tearDown(self):
+        helper.clear_plan_cache()
+
+    def test_hits_and_misses(self):
+        people = list(Person.objects.all())
+        Person.objects.bulk_update(people, update_fields=['age'])
+        Person.objects.bulk_update(people, update_fields=('age',))
+        Person.objects.bulk_update(people, update_fields=['name'])
+
+        info = helper.plan_cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.currsize, 2)
+        self.assertEqual(info.maxsize, helper.PLAN_CACHE_SIZE)
+
+    def test_same_plan(self):
+        meta = Person._meta
+        plan = helper.get_plan(meta, update_fields=['age'])
+        self.assertIs(plan, helper.get_plan(meta, update_fields=['age']))
+        self.assertIsNot(plan, helper.get_plan(meta, update_fields=['age'],
+                                               exclude_fields=['name']))
+        self.assertIsNot(plan, helper.get_plan(PersonUUID._meta,
+                                               update_fields=['age']))
+
+    def test_wrong_field_names_are_not_cached(self):
+        self.assertRaises(TypeError, helper.get_plan, Person._meta,
+                          update_fields=['somecolumn'])
+        self.assertEqual(helper.plan_cache_info().currsize, 0)
+
+    def test_lru(self):
+        cache = helper.PlanCache(maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 3)
+        cache.get('c', lambda: 4)
+
+        self.assertEqual(cache.get('a', lambda: 5), 1)
+        self.assertEqual(cache.get('b', lambda: 6), 6)
+        self.assertEqual(cache.info(), helper.CacheInfo(2, 4, 2, 2))
+
+    def test_case_sql(self):
+        plan = helper.get_plan(Person._meta, update_fields=['age'])
+        field = plan.fields[0]
+        if plan.use_cast:
+            expected = ('"age" = CAST(CASE "id" WHEN %s THEN %s '
+                        'WHEN %s THEN %s ELSE "age" END AS integer)')
+        else:
+            expected = ('"age" = (CASE "id" WHEN %s THEN %s '
+                        'WHEN %s THEN %s ELSE "age" END)')
+        self.assertEqual(plan.case_sql(field, 2), expected)
+        self.assertEqual(
+            plan.case_sql(field, 2, ['%s', '"age" - %s']),
+            expected.replace('THEN %s ELSE', 'THEN "age" - %s ELSE'))
+
+    def test_skeletons_are_reused(self):
+        plan = helper.get_plan(Person._meta)
+        fields = plan.fields
+        builds = []
+
+        def build_all():
+            for n in (7, 3):
+                plan.set_sql(fields, n)
+                for field in fields:
+                    plan.case_sql(field, n)
+
+        cached = plan._cached
+
+        def counting_cached(key, build):
+            return cached(key, lambda: builds.append(key) or build())
+
+        plan._cached = counting_cached
+        try:
+            build_all()
+            n_builds = len(builds)
+            build_all()
+            build_all()
+        finally:
+            del plan._cached
+
+        # every skeleton of a wide model is kept across calls
+        self.assertGreater(len(fields), 20)
+        self.assertEqual(len(builds), n_builds)
+
+    def test_connection_of_the_thread(self):
+        plan = helper.get_plan(Person._meta, update_fields=['age'])
+        used = []
+        thread = threading.Thread(
+            target=lambda: used.append(plan.connection))
+        thread.start()
+        thread.join()
+
+        self.assertIs(plan.connection, connections[plan.using])
+        self.assertEqual(used[0].alias, plan.using)
+        self.assertIsNot(used[0], plan.connection)
+        self.assertIsNot(
+            plan.get_compiler(connection).query,
+            plan.get_compiler(connection).query)
+
+
+class OnlyChangedTests(TestCase):
+
+    def setUp(self):
+        TrackedPerson.objects.bulk_create([
+            TrackedPerson(name='name %s' % idx, age=idx, data={'idx': idx})
+            for idx in range(10)
+        ])
+
+    def test_unchanged(self):
+        people = TrackedPerson.objects.all()
+        self.assertNumQueries(1, TrackedPerson.objects.bulk_update,
+                              people, only_changed=True)
+
+    def test_save_update_fields(self):
+        person = TrackedPerson.objects.order_by('pk')[0]
+        person.age = 5
+        person.name = 'b'
+        person.save(update_fields=['name'])
+
+        count = TrackedPerson.objects.bulk_update(
+            [person], only_changed=True)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(TrackedPerson.objects.get(pk=person.pk).age, 5)
+
+    def test_rolled_back(self):
+        people = list(TrackedPerson.objects.order_by('pk'))
+        for person in people:
+            person.age += 100
+        batches = []
+
+        def fail_second_batch(sender, **kwargs):
+            batches.append(kwargs['rows'])
+            if len(batches) == 2:
+                raise IntegrityError('second batch')
+
+        signals.batch_updated.connect(fail_second_batch, sender=TrackedPerson)
+        try:
+            with self.assertRaises(IntegrityError):
+                TrackedPerson.objects.bulk_update(
+                    people, only_changed=True, atomic=True, batch_size=5)
+        finally:
+            signals.batch_updated.disconnect(
+                fail_second_batch, sender=TrackedPerson)
+
+        ages = TrackedPerson.objects.order_by('pk').values_list(
+            'age', flat=True)
+        self.assertEqual(list(ages), list(range(10)))
+
+        # the first batch was rolled back too, so it's sent again
+        count = TrackedPerson.objects.bulk_update(
+            people, only_changed=True, atomic=True, batch_size=5)
+
+        self.assertEqual(count, 10)
+        self.assertEqual(list(ages.all()), list(range(100, 110)))
+
+    def test_only_changed(self):
+        people = list(TrackedPerson.objects.order_by('pk'))
+        people[1].age = 100
+        people[2].age = 200
+        people[3].name = 'changed'
+        people[4].data['idx'] = 400
+
+        with CaptureQueriesContext(connection) as ctx:
+            count = TrackedPerson.objects.bulk_update(people,
+                                                      only_changed=True)
+
+        self.assertEqual(count, 4)
+        # one query by set of changed fields
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual(
+            len([query for query in ctx.captured_queries
+                 if '"name"' in query['sql']]),
+            1)
+
+        people = list(TrackedPerson.objects.order_by('pk'))
+        self.assertEqual([person.age for person in people[:4]],
+                         [0, 100, 200, 3])
+        self.assertEqual(people[3].name, 'changed')
+        self.assertEqual(people[4].data, {'idx': 400})
+
+    def test_snapshot_is_refreshed(self):
+        people = list(TrackedPerson.objects.all())
+        people[0].age = 100
+        self.assertEqual(
+            TrackedPerson.objects.bulk_update(people, only_changed=True), 1)
+        self.assertEqual(
+            TrackedPerson.objects.bulk_update(people, only_changed=True), 0)
+
+        people[0].save()
+        self.assertEqual(tracking.get_changed_fields(
+            people[0], TrackedPerson._meta.concrete_fields), [])
+
+    def test_expressions_are_changed(self):
+        people = list(TrackedPerson.objects.order_by('pk'))
+        people[0].age = F('age') + 1
+        self.assertEqual(
+            TrackedPerson.objects.bulk_update(people, only_changed=True), 1)
+        self.assertEqual(TrackedPerson.objects.order_by('pk')[0].age, 1)
+
+    def test_snapshot_helper(self):
+        create_fixtures(3)
+        people = list(Person.objects.order_by('pk'))
+        for person in people[1:]:
+            tracking.snapshot(person)
+        for person in people:
+            person.age += 1
+
+        # people[0] has no snapshot, so all of its fields are sent
+        with CaptureQueriesContext(connection) as ctx:
+            count = Person.objects.bulk_update(people, only_changed=True)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        ages = Person.objects.order_by('pk').values_list('age', flat=True)
+        self.assertEqual(list(ages), [person.age for person in people])
+
+
+class PipelineTests(TestCase):
+
+    def setUp(self):
+        create_fixtures(20)
+
+    def test_pipeline(self):
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = idx
+            person.name = Func(F('name'), function='UPPER')
+
+        with CaptureQueriesContext(connection) as ctx:
+            count = Person.objects.bulk_update(
+                people, update_fields=['age', 'name'], batch_size=3,
+                pipeline=2)
+
+        self.assertEqual(count, 20)
+        self.assertEqual(len(ctx.captured_queries), 7)
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx)
+            self.assertEqual(person.name, person.name.upper())
+
+    def test_prepare_errors_are_raised(self):
+        people = list(Person.objects.order_by('pk'))
+        for person in people:
+            person.age = 1000
+        people[10].age = 'not a number'
+
+        self.assertRaises(ValueError, Person.objects.bulk_update, people,
+                          update_fields=['age'], batch_size=3, pipeline=1)
+        self.assertEqual(Person.objects.filter(age=1000).count(), 9)
+
+    def test_execute_errors_are_raised(self):
+        people = list(Person.objects.order_by('pk'))
+        for person in people:
+            person.age = None
+
+        # a single prepared batch at a time, the producer must not block
+        self.assertRaises(IntegrityError, Person.objects.bulk_update, people,
+                          update_fields=['age'], batch_size=1, pipeline=1)
+
+    def test_pipeline_and_workers(self):
+        self.assertRaises(AssertionError, Person.objects.bulk_update,
+                          Person.objects.all(), workers=2, pipeline=1)
+
+
+class WorkersTests(TransactionTestCase):
+
+    # sqlite only allows one writer at a time
+    workers = 1 if connection.vendor == 'sqlite' else 2
+
+    def setUp(self):
+        create_fixtures(50)
+
+    def test_workers(self):
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            person.age = idx
+            person.name = 'name %s' % idx
+
+        count = Person.objects.bulk_update(people, update_fields=['age', 'name'],
+                                           batch_size=7, workers=self.workers)
+        self.assertEqual(count, 50)
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx)
+            self.assertEqual(person.name, 'name %s' % idx)
+
+    def test_duplicates_across_batches(self):
+        people = list(Person.objects.order_by('pk').all())
+        for person in people:
+            person.age = 1
+        duplicates = list(Person.objects.order_by('pk').all())[6:8]
+        for person in duplicates:
+            person.age = 2
+
+        # the duplicates would straddle the first two batches
+        count = Person.objects.bulk_update(
+            people + duplicates, update_fields=['age'], batch_size=7,
+            workers=self.workers, atomic=True, sort_pks=False)
+
+        self.assertEqual(count, 50)
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [1] * 6 + [2] * 2 + [1] * 42)
+
+    def test_last_per_pk(self):
+        people = [Person(pk=1), Person(pk=2), Person(pk=2), Person(pk=3)]
+        self.assertEqual(
+            [id(person) for person in helper._last_per_pk(people, 'id')],
+            [id(people[0]), id(people[2]), id(people[3])])
+
+    def test_atomic_workers(self):
+        people = list(Person.objects.order_by('pk').all())
+        for person in people:
+            person.age = 1000
+        people[-1].age = 'not a number'
+
+        self.assertRaises(ValueError, Person.objects.bulk_update, people,
+                          update_fields=['age'], batch_size=7, workers=self.workers,
+                          atomic=True)
+        self.assertFalse(Person.objects.filter(age=1000).exists())
+
+    def test_errors_are_raised(self):
+        people = list(Person.objects.order_by('pk').all())
+        people[10].age = 'not a number'
+
+        self.assertRaises(ValueError, Person.objects.bulk_update, people,
+                          update_fields=['age'], batch_size=7, workers=self.workers)
+
+    def test_atomic(self):
+        people = list(Person.objects.order_by('pk').all())
+        for person in people:
+            person.age = 1000
+        people[-1].age = 'not a number'
+
+        self.assertRaises(ValueError, Person.objects.bulk_update, people,
+                          update_fields=['age'], batch_size=7, atomic=True)
+        self.assertFalse(Person.objects.filter(age=1000).exists())
+
+
+@skipUnless(sys.version_info >= (3, 5), "async requires python 3.5+")
+class AsyncTests(TransactionTestCase):
+
+    def setUp(self):
+        create_fixtures(20)
+
+    def run_async(self, coroutine):
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_abulk_update(self):
+        people = list(Person.objects.order_by('pk'))
+        for idx, person in enumerate(people):
+            person.age = idx
+            person.text = 'text %s' % idx
+
+        count = self.run_async(Person.objects.abulk_update(
+            people, update_fields=['age', 'text'], batch_size=3))
+        self.assertEqual(count, 20)
+
+        people = Person.objects.order_by('pk').all()
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx)
+            self.assertEqual(person.text, 'text %s' % idx)
+
+    def test_helper(self):
+        people = list(Person.objects.order_by('pk'))
+        for person in people:
+            person.age = F('age') + 1
+        ages = [person.age for person in Person.objects.order_by('pk')]
+
+        self.run_async(helper.abulk_update(people, update_fields=['age']))
+
+        self.assertEqual(
+            [person.age for person in Person.objects.order_by('pk')],
+            [age + 1 for age in ages])
+
+    def test_empty(self):
+        self.assertIsNone(self.run_async(Person.objects.abulk_update([])))
+
+    def test_errors_are_raised(self):
+        people = list(Person.objects.order_by('pk'))
+        people[10].age = 'not a number'
+        self.assertRaises(ValueError, self.run_async,
+                          Person.objects.abulk_update(people, batch_size=3))
+
+
+@skipUnless(connection.vendor == 'mysql',
+            "The 'join' strategy is only available in MySQL.")
+class JoinStrategyBenchmarkTests(TestCase):
+    """
+    The 'join' strategy updates 2000 people like the case clause;
+    `python -m benchmarks --strategies case join` compares their speed.
+    """
+
+    n_objs = 2000
+
+    def setUp(self):
+        Person.objects.bulk_create(
+            [Person(name=str(idx), age=idx, big_age=idx, positive_age=idx,
+                    positive_small_age=idx, small_age=idx, height=1,
+                    float_height=1)
+             for idx in range(self.n_objs)])
+        self.people = list(Person.objects.order_by('pk'))
+
+    def test_same_result(self):
+        for strategy in ('case', 'join'):
+            for person in self.people:
+                person.age += 1
+                person.name = '{}-{}'.format(person.pk, strategy)
+
+            count = Person.objects.bulk_update(
+                self.people, update_fields=['age', 'name'],
+                strategy=strategy)
+
+            self.assertEqual(count, self.n_objs)
+            self.assertEqual(
+                list(Person.objects.order_by('pk').values_list(
+                    'age', 'name')),
+                [(person.age, person.name) for person in self.people])
+
+
+class ParametersBenchmarkTests(TestCase):
+    """
+    The parameters and case clauses assembly gives the same result as the
+    previous implementation; `python -m benchmarks.parameters` compares
+    their speed and memory.
+    """
+
+    def test_same_result(self):
+        from benchmarks.parameters import Batch
+
+        batch = Batch(n_objs=1000, n_fields=20)
+        legacy, builder = batch.legacy(), batch.builder()
+
+        self.assertEqual(sorted(legacy[0].split(', ')),
+                         sorted(builder[0].split(', ')))
+        self.assertEqual(sorted(legacy[1]), sorted(builder[1]))
+
+
+class BulkUpdateValuesTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        self.pks = list(
+            Person.objects.order_by('pk').values_list('pk', flat=True))
+
+    def test_bulk_update_values(self):
+        dates = [date(2015, 3, idx + 1) for idx in range(len(self.pks))]
+        count = helper.bulk_update_values(Person, self.pks, {
+            'age': [idx * 3 for idx in range(len(self.pks))],
+            'name': ['name %s' % idx for idx in range(len(self.pks))],
+            'float_height': [0.5, 1, 1.5, 2, 2.5, 3],
+            'default': [1, 2, 3, 4, 5, None],
+            'date': dates,
+        }, batch_size=4)
+        self.assertEqual(count, len(self.pks))
+
+        people = Person.objects.order_by('pk')
+        for idx, person in enumerate(people):
+            self.assertEqual(person.age, idx * 3)
+            self.assertEqual(person.name, 'name %s' % idx)
+            self.assertEqual(person.date, dates[idx])
+            self.assertEqual(person.float_height, idx * 0.5 + 0.5)
+        self.assertIsNone(people[5].default)
+
+    def test_manager(self):
+        Person.objects.bulk_update_values(
+            self.pks[:2], {'age': [100, 101], 'role_id': [None, None]})
+        self.assertEqual(
+            list(Person.objects.filter(pk__in=self.pks[:2])
+                 .order_by('pk').values_list('age', flat=True)),
+            [100, 101])
+
+    def test_expressions(self):
+        ages = list(Person.objects.order_by('pk').values_list('age', flat=True))
+        helper.bulk_update_values(
+            Person, self.pks, {'age': [F('age') + 1] * len(self.pks)})
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [age + 1 for age in ages])
+
+    def test_fast_path(self):
+        plan = helper.get_plan(Person._meta, ['age', 'name', 'date'])
+        age, name, date_field = [
+            Person._meta.get_field(name) for name in ('age', 'name', 'date')]
+
+        values = [1, None, 3]
+        column, placeholders = helper._prepare_column(
+            age, values, plan, connection)
+        self.assertEqual(column, values)
+        self.assertIsNone(placeholders)
+
+        column, placeholders = helper._prepare_column(
+            age, ['1', 2], plan, connection)
+        self.assertEqual(column, [1, 2])
+
+        column, placeholders = helper._prepare_column(
+            name, ['a', None], plan, connection)
+        self.assertEqual(column, ['a', None])
+
+        column, placeholders = helper._prepare_column(
+            date_field, [date(2015, 3, 28)], plan, connection)
+        self.assertEqual(
+            column, [date_field.get_db_prep_save(date(2015, 3, 28),
+                                                 connection=connection)])
+
+    def test_wrong_lengths(self):
+        self.assertRaises(ValueError, helper.bulk_update_values,
+                          Person, self.pks, {'age': [1]})
+
+    def test_wrong_field_names(self):
+        self.assertRaises(TypeError, helper.bulk_update_values,
+                          Person, self.pks, {'somecolumn': self.pks})
+
+    def test_nothing_to_update(self):
+        self.assertIsNone(helper.bulk_update_values(Person, [], {'age': []}))
+        self.assertIsNone(helper.bulk_update_values(Person, self.pks, {}))
+
+
+class BulkUpsertTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+
+    def new_person(self, idx):
+        return Person(
+            name='new %s' % idx, age=idx, big_age=idx, positive_age=idx,
+            positive_small_age=idx, small_age=idx, height=1, float_height=1)
+
+    def test_bulk_upsert(self):
+        people = list(Person.objects.order_by('pk'))
+        for idx, person in enumerate(people):
+            person.age = idx + 50
+        new_people = [self.new_person(idx) for idx in range(3)]
+
+        result = Person.objects.bulk_upsert(people + new_people)
+
+        self.assertEqual(result, helper.UpsertResult(3, len(people)))
+        self.assertEqual(Person.objects.count(), len(people) + 3)
+        self.assertEqual(
+            list(Person.objects.filter(pk__in=[p.pk for p in people])
+                 .order_by('pk').values_list('age', flat=True)),
+            [idx + 50 for idx in range(len(people))])
+        self.assertEqual(
+            sorted(Person.objects.filter(name__startswith='new ')
+                   .values_list('age', flat=True)),
+            [0, 1, 2])
+
+    def test_auto_now_add(self):
+        person = TimestampedPerson.objects.create(name='old')
+        created = person.created
+        person.name = 'new'
+
+        result = TimestampedPerson.objects.bulk_upsert(
+            [person, TimestampedPerson(name='other')])
+
+        self.assertEqual(result, helper.UpsertResult(1, 1))
+        self.assertEqual(person.created, created)
+        self.assertEqual(
+            TimestampedPerson.objects.get(pk=person.pk).created, created)
+        self.assertEqual(
+            TimestampedPerson.objects.get(pk=person.pk).name, 'new')
+        self.assertIsNotNone(
+            TimestampedPerson.objects.get(name='other').created)
+
+    def test_update_fields(self):
+        people = list(Person.objects.order_by('pk'))
+        names = [person.name for person in people]
+        for idx, person in enumerate(people):
+            person.age = idx + 50
+            person.name = 'upserted'
+
+        result = Person.objects.bulk_upsert(
+            people, update_fields=['age'], conflict_fields=['pk'],
+            batch_size=4)
+
+        self.assertEqual(result, (0, len(people)))
+        people = Person.objects.order_by('pk')
+        self.assertEqual([person.name for person in people], names)
+        self.assertEqual([person.age for person in people],
+                         [idx + 50 for idx in range(len(people))])
+
+    def test_insert_with_given_pk(self):
+        person = PersonUUID(age=5)
+
+        result = PersonUUID.objects.bulk_upsert([person])
+        self.assertEqual(result, (1, 0))
+
+        person.age = 6
+        result = PersonUUID.objects.bulk_upsert([person])
+        self.assertEqual(result, (0, 1))
+        self.assertEqual(PersonUUID.objects.get(pk=person.pk).age, 6)
+
+    def test_state(self):
+        person = self.new_person(0)
+        people = list(Person.objects.order_by('pk')) + [person]
+
+        Person.objects.bulk_upsert(people)
+
+        for existing in people[:-1]:
+            self.assertFalse(existing._state.adding)
+        # only PostgreSQL returns the pks of the inserted rows
+        self.assertEqual(person._state.adding, person.pk is None)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite version check.')
+    def test_old_sqlite(self):
+        version_info = connection.Database.sqlite_version_info
+        connection.Database.sqlite_version_info = (3, 23, 1)
+        try:
+            with self.assertRaises(ValueError) as error:
+                Person.objects.bulk_upsert([self.new_person(0)])
+        finally:
+            connection.Database.sqlite_version_info = version_info
+
+        self.assertIn('3.23.1', str(error.exception))
+
+    def test_nothing_to_update(self):
+        self.assertEqual(Person.objects.bulk_upsert([]), (0, 0))
+        self.assertRaises(ValueError, Brand.objects.bulk_upsert,
+                          [Brand(name='brand')], update_fields=[],
+                          conflict_fields=['name'])
+
+    def test_wrong_conflict_fields(self):
+        self.assertRaises(TypeError, Person.objects.bulk_upsert,
+                          [self.new_person(0)], conflict_fields=['nope'])
+
+
+class RowcountTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+
+    def test_deleted_rows_are_not_counted(self):
+        people = list(Person.objects.order_by('pk'))
+        for person in people:
+            person.age += 1
+        people[0].delete()
+
+        self.assertEqual(Person.objects.bulk_update(people, batch_size=2),
+                         len(people) - 1)
+        self.assertEqual(
+            Person.objects.bulk_update(people, batch_size=2, pipeline=1),
+            len(people) - 1)
+
+    def test_bulk_update_values(self):
+        pks = list(Person.objects.values_list('pk', flat=True))
+        Person.objects.filter(pk=pks[0]).delete()
+
+        self.assertEqual(
+            helper.bulk_update_values(Person, pks, {'age': pks}),
+            len(pks) - 1)
+
+
+@skipUnless(
+    connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and
+        connection.Database.sqlite_version_info >= (3, 35)),
+    'RETURNING is only supported by PostgreSQL and SQLite 3.35+.')
+class ReturningTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+
+    def test_returning(self):
+        people = list(Person.objects.order_by('pk'))
+        ages = [person.age for person in people]
+        for person in people:
+            person.age = F('age') + 1
+            person.date_time = Concat(Value('2015-03-28 '), Value('12:00'))
+
+        count = Person.objects.bulk_update(
+            people, update_fields=['age', 'date_time'],
+            returning=['age', 'date_time'], batch_size=4)
+
+        self.assertEqual(count, len(people))
+        self.assertEqual([person.age for person in people],
+                         [age + 1 for age in ages])
+        for person in people:
+            self.assertEqual(person.date_time.replace(tzinfo=None),
+                             datetime(2015, 3, 28, 12, 0))
+
+    def test_deleted_objects_are_untouched(self):
+        people = list(Person.objects.order_by('pk'))
+        for person in people:
+            person.age = F('age') + 1
+        people[0].delete()
+
+        count = Person.objects.bulk_update(
+            people, update_fields=['age'], returning=['age'])
+
+        self.assertEqual(count, len(people) - 1)
+        self.assertTrue(hasattr(people[0].age, 'resolve_expression'))
+        for person in people[1:]:
+            self.assertIsInstance(person.age, int)
+
+    def test_returned_fields_are_snapshotted(self):
+        TrackedPerson.objects.create(name='one', age=1)
+        person = TrackedPerson.objects.get()
+        person.age = F('age') + 1
+
+        TrackedPerson.objects.bulk_update(
+            [person], only_changed=True, returning=['age'])
+
+        self.assertEqual(person.age, 2)
+        self.assertEqual(tracking.get_changed_fields(
+            person, TrackedPerson._meta.concrete_fields[1:]), [])
+
+    def test_not_supported_by_strategy(self):
+        people = Person.objects.all()
+        self.assertRaises(ValueError, Person.objects.bulk_update,
+                          people, strategy='copy', returning=['age'])
+
+
+class VersionFieldTests(TestCase):
+
+    def setUp(self):
+        helper.clear_plan_cache()
+        VersionedPerson.objects.bulk_create(
+            [VersionedPerson(name=str(idx), age=idx) for idx in range(4)])
+        self.people = list(VersionedPerson.objects.order_by('pk'))
+
+    def tearDown(self):
+        helper.clear_plan_cache()
+
+    def ages(self):
+        return list(VersionedPerson.objects.order_by('pk')
+                    .values_list('age', 'version'))
+
+    def test_versions_are_incremented(self):
+        for person in self.people:
+            person.age += 10
+
+        count = VersionedPerson.objects.bulk_update(
+            self.people, version_field='version', batch_size=3)
+
+        self.assertEqual(count, 4)
+        self.assertEqual(self.ages(), [(idx + 10, 1) for idx in range(4)])
+        self.assertEqual([person.version for person in self.people],
+                         [1] * 4)
+
+    def test_stale_objects(self):
+        VersionedPerson.objects.filter(pk=self.people[1].pk).update(
+            age=100, version=1)
+        for person in self.people:
+            person.age += 10
+
+        with self.assertRaises(helper.StaleObjectsError) as error:
+            VersionedPerson.objects.bulk_update(
+                self.people, version_field='version')
+
+        self.assertEqual(error.exception.pks, [self.people[1].pk])
+        self.assertEqual(error.exception.rowcount, 3)
+        self.assertEqual(self.ages(), [(10, 1), (100, 1), (12, 1), (13, 1)])
+        self.assertEqual([person.version for person in self.people],
+                         [1, 0, 1, 1])
+
+    def test_stale_objects_atomic(self):
+        VersionedPerson.objects.filter(pk=self.people[1].pk).update(
+            version=1)
+        for person in self.people:
+            person.age += 10
+
+        self.assertRaises(
+            helper.StaleObjectsError, VersionedPerson.objects.bulk_update,
+            self.people, version_field='version', atomic=True)
+
+        self.assertEqual(self.ages(),
+                         [(0, 0), (1, 1), (2, 0), (3, 0)])
+
+    def test_stale_objects_are_still_changed(self):
+        VersionedPerson.objects.filter(pk=self.people[1].pk).update(
+            version=1)
+        for person in self.people:
+            tracking.snapshot(person)
+            person.age += 10
+
+        self.assertRaises(
+            helper.StaleObjectsError, VersionedPerson.objects.bulk_update,
+            self.people, version_field='version', only_changed=True)
+        self.people[1].version = 1
+        count = VersionedPerson.objects.bulk_update(
+            self.people, version_field='version', only_changed=True)
+
+        self.assertEqual(count, 1)
+        self.assertEqual(self.ages(), [(10, 1), (11, 2), (12, 1), (13, 1)])
+
+    def test_without_returning(self):
+        plan = helper.UpdatePlan(
+            VersionedPerson._meta, None, None, 'pk', connection, 'case',
+            False, version_field='version')
+        plan.returning = ()
+        plan.returning_sql = ''
+        VersionedPerson.objects.filter(pk=self.people[2].pk).update(
+            version=5)
+        for person in self.people:
+            person.age += 10
+
+        stale = []
+        count = helper._update_batches(
+            plan, [(plan.fields, self.people)], connection, stale=stale)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(stale, [self.people[2].pk])
+        self.assertEqual(self.ages(), [(10, 1), (11, 1), (2, 5), (13, 1)])
+        self.assertEqual([person.version for person in self.people],
+                         [1, 1, 0, 1])
+
+    def test_filtered_out_objects_are_not_stale(self):
+        VersionedPerson.objects.filter(pk=self.people[1].pk).update(
+            version=1)
+        for person in self.people:
+            person.age += 10
+
+        with self.assertRaises(helper.StaleObjectsError) as error:
+            VersionedPerson.objects.filter(age__lt=3).bulk_update(
+                self.people, version_field='version')
+
+        self.assertEqual(error.exception.pks, [self.people[1].pk])
+        self.assertEqual(error.exception.rowcount, 2)
+        self.assertEqual(self.ages(), [(10, 1), (1, 1), (12, 1), (3, 0)])
+
+    def test_filtered_out_objects_are_not_stale_without_returning(self):
+        plan = helper.UpdatePlan(
+            VersionedPerson._meta, None, None, 'pk', connection, 'case',
+            False, version_field='version')
+        plan.returning = ()
+        plan.returning_sql = ''
+        plan = plan.filtered(VersionedPerson.objects.filter(age__lt=3))
+        VersionedPerson.objects.filter(pk=self.people[1].pk).update(
+            version=1)
+        for person in self.people:
+            person.age += 10
+
+        stale = []
+        count = helper._update_batches(
+            plan, [(plan.fields, self.people)], connection, stale=stale)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(stale, [self.people[1].pk])
+        self.assertEqual([person.version for person in self.people],
+                         [1, 0, 1, 0])
+
+    def test_version_field_is_not_updated_from_objects(self):
+        self.people[0].version = 7
+        self.assertRaises(
+            helper.StaleObjectsError, VersionedPerson.objects.bulk_update,
+            self.people[:1], version_field='version')
+        self.assertEqual(self.ages()[0], (0, 0))
+
+    def test_wrong_version_field(self):
+        self.assertRaises(TypeError, VersionedPerson.objects.bulk_update,
+                          self.people, version_field='name')
+        self.assertRaises(TypeError, VersionedPerson.objects.bulk_update,
+                          self.people, version_field='nope')
+
+
+class QuerySetFilterTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        self.people = list(Person.objects.order_by('pk'))
+        for idx, person in enumerate(self.people):
+            person.certified = idx % 2 == 0
+            person.save()
+            person.age = 1000 + idx
+
+    def ages(self):
+        return list(Person.objects.order_by('pk')
+                    .values_list('age', flat=True))
+
+    def test_filters(self):
+        ages = self.ages()
+
+        count = Person.objects.filter(certified=False).bulk_update(
+            self.people, update_fields=['age'], batch_size=2)
+
+        self.assertEqual(count, len(self.people) // 2)
+        self.assertEqual(self.ages(), [
+            age if idx % 2 == 0 else 1000 + idx
+            for idx, age in enumerate(ages)
+        ])
+
+    def test_empty_querysets(self):
+        ages = self.ages()
+        pks = [person.pk for person in self.people]
+
+        for queryset in (Person.objects.none(),
+                         Person.objects.filter(pk__in=[])):
+            self.assertEqual(
+                queryset.bulk_update(self.people, update_fields=['age']), 0)
+            self.assertEqual(
+                queryset.bulk_update_values(pks, {'age': [1] * len(pks)}),
+                0)
+
+        self.assertEqual(self.ages(), ages)
+
+    def test_filters_with_params_and_expressions(self):
+        ages = self.ages()
+        for person in self.people:
+            person.age = F('age') + 1
+
+        Person.objects.filter(certified=True, age__gte=0).exclude(
+            pk=self.people[0].pk).bulk_update(
+                self.people, update_fields=['age'])
+
+        self.assertEqual(self.ages(), [
+            age + 1 if idx % 2 == 0 and idx else age
+            for idx, age in enumerate(ages)
+        ])
+
+    def test_filters_through_relations(self):
+        role = Role.objects.create(code=1)
+        Person.objects.filter(pk=self.people[1].pk).update(role=role)
+        ages = self.ages()
+
+        count = Person.objects.filter(role__code=1).bulk_update(
+            self.people, update_fields=['age'])
+
+        self.assertEqual(count, 1)
+        ages[1] = 1001
+        self.assertEqual(self.ages(), ages)
+
+    def test_bulk_update_values(self):
+        ages = self.ages()
+        pks = [person.pk for person in self.people]
+
+        Person.objects.filter(certified=True).bulk_update_values(
+            pks, {'age': [0] * len(pks)})
+
+        self.assertEqual(self.ages(), [
+            0 if idx % 2 == 0 else age for idx, age in enumerate(ages)])
+
+    def test_other_model(self):
+        self.assertRaises(
+            TypeError, helper.bulk_update, self.people,
+            queryset=PersonUUID.objects.filter(age=1))
+
+    def test_sliced_queryset(self):
+        self.assertRaises(AssertionError, Person.objects.all()[:2].bulk_update,
+                          self.people)
+
+
+class GroupedValuesTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        self.people = list(Person.objects.order_by('pk'))
+
+    def update(self, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            Person.objects.bulk_update(self.people, **kwargs)
+        self.assertEqual(len(queries), 1)
+        return queries[0]['sql']
+
+    def test_same_value(self):
+        for person in self.people:
+            person.age = 77
+            person.name = None
+
+        sql = self.update(update_fields=['age', 'name'])
+
+        self.assertNotIn('CASE', sql)
+        self.assertEqual(
+            list(Person.objects.values_list('age', 'name').distinct()),
+            [(77, None)])
+
+    def test_duplicate_pks(self):
+        # [pk1='b', pk2='a', pk2='b', pk3='a', pk4='b', pk5='a']
+        duplicate = Person.objects.get(pk=self.people[1].pk)
+        self.people.insert(2, duplicate)
+        del self.people[6:]
+        for person, name in zip(self.people, 'bababa'):
+            person.name = name
+
+        sql = self.update(update_fields=['name'])
+
+        # the first value of a pk wins, as without any group
+        self.assertNotIn(' IN (', sql)
+        self.assertEqual(Person.objects.get(pk=duplicate.pk).name, 'a')
+
+    def test_few_values(self):
+        for idx, person in enumerate(self.people):
+            person.certified = idx % 2 == 0
+            person.age = idx
+
+        sql = self.update(update_fields=['age', 'certified'])
+
+        self.assertEqual(sql.count(' IN ('), 2)
+        self.assertEqual(
+            list(Person.objects.order_by('pk')
+                 .values_list('age', 'certified')),
+            [(idx, idx % 2 == 0) for idx in range(len(self.people))])
+
+    def test_group_values(self):
+        pks = [1, 2, 3, 4, 5]
+        self.assertEqual(
+            helper._group_values(pks, ['a', 'b', 'a', 'a', 'b']),
+            [('a', [1, 3, 4]), ('b', [2, 5])])
+        self.assertEqual(
+            helper._group_values(pks, [1, True, 1, 1, True]),
+            [(1, [1, 3, 4]), (True, [2, 5])])
+        self.assertIsNone(helper._group_values(pks, [1, 2, 3, 1, 1]))
+        self.assertIsNone(helper._group_values(pks, [[1], [1], [1], [1], [1]]))
+        self.assertIsNone(helper._group_values([1], ['a']))
+
+
+class SortPksTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        self.people = list(Person.objects.order_by('pk'))
+
+    def test_last_write_wins(self):
+        duplicate = Person.objects.get(pk=self.people[0].pk)
+        self.people[0].age = 1
+        duplicate.age = 2
+
+        count = Person.objects.bulk_update(
+            self.people + [duplicate], update_fields=['age'], sort_pks=True)
+
+        self.assertEqual(count, len(self.people))
+        self.assertEqual(Person.objects.get(pk=duplicate.pk).age, 2)
+
+    def test_sorted_batches(self):
+        people = self.people[::-1]
+        for person in people:
+            person.age = person.pk
+        pks = [person.pk for person in self.people]
+
+        with CaptureQueriesContext(connection) as queries:
+            Person.objects.bulk_update(
+                people, update_fields=['age'], sort_pks=True, batch_size=3)
+
+        self.assertEqual(len(queries), 2)
+        for query, batch_pks in zip(queries, [pks[3:], pks[:3]]):
+            self.assertIn(
+                'in ({})'.format(', '.join(map(str, batch_pks))),
+                query['sql'])
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            pks)
+
+    def test_sort_batch(self):
+        plan = helper.get_plan(Person._meta, update_fields=['age'])
+        people = [Person(pk=3), Person(pk=None), Person(pk=1), Person(pk=3)]
+
+        self.assertEqual(
+            [id(person) for person in helper._sort_batch(plan, people)],
+            [id(people[2]), id(people[3]), id(people[1])])
+
+
+class RecordingCursor(object):
+
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, sql, parameters=None):
+        self.queries.append((sql, parameters))
+
+
+class PreparedStatementsTests(TestCase):
+
+    def test_numbered_placeholders(self):
+        self.assertEqual(
+            helper._numbered_placeholders(
+                "a = %s WHERE b LIKE 'x%%' AND c IN (%s, %s)"),
+            "a = $1 WHERE b LIKE 'x%' AND c IN ($2, $3)")
+
+    def test_prepared_from_second_execution(self):
+        statements = helper.PreparedStatements(None, maxsize=2)
+        cursor = RecordingCursor()
+
+        for _ in range(3):
+            statements.execute(cursor, 'UPDATE t SET a = %s', [1])
+
+        self.assertEqual(cursor.queries, [
+            ('UPDATE t SET a = %s', [1]),
+            ('PREPARE bulk_update_1 AS UPDATE t SET a = $1', None),
+            ('EXECUTE bulk_update_1(%s)', [1]),
+            ('EXECUTE bulk_update_1(%s)', [1]),
+        ])
+
+    def test_deallocated_on_eviction(self):
+        statements = helper.PreparedStatements(None, maxsize=2)
+        cursor = RecordingCursor()
+
+        for sql in ['UPDATE a', 'UPDATE a', 'UPDATE b', 'UPDATE c']:
+            statements.execute(cursor, sql, [])
+
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(
+            cursor.queries[-1], ('DEALLOCATE bulk_update_1', None))
+
+    def test_values_are_not_grouped(self):
+        plan = helper.get_plan(Person._meta, update_fields=['age']).prepared()
+        statements = helper.PreparedStatements(None, maxsize=2)
+        cursor = RecordingCursor()
+
+        # the first batch would be grouped, not the second one
+        for column in ([1, 1, 1, 1], [1, 2, 3, 4]):
+            sql, parameters = helper._batch_sql(
+                plan, plan.fields, [1, 2, 3, 4], [column], [None])
+            statements.execute(cursor, sql, parameters)
+
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(cursor.queries[1][0].startswith(
+            'PREPARE bulk_update_1 AS '))
+        self.assertTrue(cursor.queries[2][0].startswith(
+            'EXECUTE bulk_update_1('))
+
+    def test_per_connection(self):
+        connection.ensure_connection()
+        statements = helper.get_prepared_statements(connection)
+        self.assertIs(helper.get_prepared_statements(connection), statements)
+
+    @skipUnless(settings.DATABASES['default']['USER'] != 'postgres',
+                "Prepared statements are only supported by PostgreSQL.")
+    def test_not_supported(self):
+        create_fixtures()
+        with self.assertRaises(ValueError):
+            Person.objects.bulk_update(
+                Person.objects.all(), update_fields=['age'], prepare=True)
+
+    @skipUnless(settings.DATABASES['default']['USER'] == 'postgres',
+                "Prepared statements are only supported by PostgreSQL.")
+    def test_prepare(self):
+        create_fixtures(10)
+        for strategy in ('case', 'values'):
+            people = list(Person.objects.order_by('pk'))
+            for person in people:
+                person.age += 1
+                person.name = 'name {}'.format(person.pk)
+
+            count = Person.objects.bulk_update(
+                people, update_fields=['age', 'name'], batch_size=3,
+                strategy=strategy, prepare=True)
+
+            self.assertEqual(count, 10)
+            for person in Person.objects.order_by('pk'):
+                self.assertEqual(person.name, 'name {}'.format(person.pk))
+
+
+class PadBatchesTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        self.people = list(Person.objects.order_by('pk'))
+
+    def test_padded_length(self):
+        plan = helper.get_plan(Person._meta, update_fields=['age'])
+
+        padded = plan.padded()
+        self.assertEqual(helper._padded_length(padded, 1, 1), 1)
+        self.assertEqual(helper._padded_length(padded, 37, 1), 64)
+        self.assertEqual(helper._padded_length(padded, 64, 1), 64)
+        # sqlite's 999 parameters
+        self.assertEqual(helper._padded_length(padded, 300, 1), 333)
+
+        padded = plan.padded(batch_size=100)
+        self.assertEqual(helper._padded_length(padded, 70, 1), 100)
+
+    def test_pad_batches(self):
+        people = self.people[:3]
+        for person in people:
+            person.age = 20
+            person.name = 'name {}'.format(person.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            count = Person.objects.bulk_update(
+                people, update_fields=['age', 'name'], pad_batches=True)
+
+        self.assertEqual(count, 3)
+        pks = [person.pk for person in people]
+        # the last row is repeated, and equal values aren't grouped
+        self.assertIn(
+            'in ({})'.format(', '.join(map(str, pks + pks[-1:]))),
+            queries[0]['sql'])
+        self.assertEqual(queries[0]['sql'].count('WHEN'), 8)
+        for person in Person.objects.order_by('pk'):
+            if person.pk in pks:
+                self.assertEqual(person.age, 20)
+                self.assertEqual(person.name, 'name {}'.format(person.pk))
+            else:
+                self.assertNotEqual(person.age, 20)
+
+    def test_same_statements(self):
+        statements = set()
+        for n_people in (3, 4):
+            with CaptureQueriesContext(connection) as queries:
+                Person.objects.bulk_update(
+                    self.people[:n_people], update_fields=['age'],
+                    pad_batches=True)
+            statements.add(queries[0]['sql'].split(' WHERE ')[0].count('%s'))
+        self.assertEqual(len(statements), 1)
+
+    def test_version_field(self):
+        VersionedPerson.objects.bulk_create(
+            [VersionedPerson(name=str(idx), age=idx) for idx in range(3)])
+        people = list(VersionedPerson.objects.order_by('pk'))
+        for person in people:
+            person.age += 10
+
+        count = VersionedPerson.objects.bulk_update(
+            people, version_field='version', pad_batches=True)
+
+        self.assertEqual(count, 3)
+        self.assertEqual([person.version for person in people], [1] * 3)
+        self.assertEqual(
+            list(VersionedPerson.objects.values_list('version', flat=True)),
+            [1] * 3)
+
+    def test_bulk_update_values(self):
+        pks = [person.pk for person in self.people[:5]]
+
+        count = helper.bulk_update_values(
+            Person, pks, {'age': [1, 2, 3, 4, 5]}, pad_batches=True)
+
+        self.assertEqual(count, 5)
+        self.assertEqual(
+            list(Person.objects.filter(pk__in=pks).order_by('pk')
+                 .values_list('age', flat=True)),
+            [1, 2, 3, 4, 5])
+
+
+class ConvertersTests(TestCase):
+
+    def setUp(self):
+        self.plan = helper.get_plan(Person._meta, ['age', 'date_time'])
+
+    def prepared(self, field, value):
+        return field.get_db_prep_save(value, connection=connection)
+
+    def test_converters(self):
+        age = Person._meta.get_field('age')
+        data = Person._meta.get_field('data')
+
+        self.assertEqual(self.plan.converters(age),
+                         {int: None, type(None): None})
+        self.assertIs(self.plan.converters(age), self.plan.converters(age))
+        # unknown field types take the generic path
+        self.assertEqual(self.plan.converters(data), {})
+
+    def test_collect_column(self):
+        age = Person._meta.get_field('age')
+        people = [Person(age=1), Person(age=F('age') + 1), Person(age='3')]
+
+        column, placeholders = helper._collect_column(
+            self.plan, people, age, connection)
+
+        self.assertEqual(column[0], 1)
+        self.assertEqual(column[2], 3)
+        self.assertEqual(placeholders[0], '%s')
+        self.assertIn('age', placeholders[1])
+
+    def test_uuid(self):
+        plan = helper.get_plan(PersonUUID._meta, ['age'])
+        value = uuid4()
+
+        column = helper._collect_column(
+            plan, [PersonUUID(uuid=value)], plan.pk_field, connection)[0]
+
+        self.assertEqual(column, [self.prepared(plan.pk_field, value)])
+
+    def test_datetime(self):
+        field = Person._meta.get_field('date_time')
+        values = [datetime(2016, 1, 2, 3, 4, 5), None]
+        people = [Person(date_time=value) for value in values]
+
+        column = helper._collect_column(
+            self.plan, people, field, connection)[0]
+
+        self.assertEqual(
+            column, [self.prepared(field, value) for value in values])
+
+    @override_settings(USE_TZ=True)
+    def test_datetime_time_zones(self):
+        field = Person._meta.get_field('date_time')
+        values = [timezone.now(), datetime(2016, 1, 2, 3, 4, 5)]
+        people = [Person(date_time=value) for value in values]
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            column = helper._collect_column(
+                self.plan, people, field, connection)[0]
+            expected = [self.prepared(field, value) for value in values]
+
+        self.assertEqual(column, expected)
+        # the naive datetime, once by each path
+        self.assertEqual(len(caught), 2)
+
+
+class SharedExpressionTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        self.people = list(Person.objects.order_by('pk'))
+        self.ages = [person.age for person in self.people]
+
+    def test_shared_expression(self):
+        for person in self.people:
+            person.age = F('age') + 1
+            person.name = 'name {}'.format(person.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            count = Person.objects.bulk_update(
+                self.people, update_fields=['age', 'name'])
+
+        self.assertEqual(count, len(self.people))
+        self.assertEqual(len(queries), 1)
+        # only the names are set in a case clause
+        self.assertEqual(queries[0]['sql'].count('CASE'), 1)
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [age + 1 for age in self.ages])
+
+    def test_different_expressions(self):
+        for idx, person in enumerate(self.people):
+            person.age = F('age') + idx % 2
+
+        with CaptureQueriesContext(connection) as queries:
+            Person.objects.bulk_update(self.people, update_fields=['age'])
+
+        self.assertEqual(queries[0]['sql'].count('CASE'), 1)
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [age + idx % 2 for idx, age in enumerate(self.ages)])
+
+    def test_compiled_once(self):
+        plan = helper.get_plan(Person._meta, ['name'])
+        field = Person._meta.get_field('name')
+        people = [
+            Person(name=Concat('name', Value('!'))) for _ in range(3)]
+
+        column, placeholders = helper._collect_column(
+            plan, people, field, connection)
+
+        self.assertIs(column[0], column[2])
+        self.assertEqual(len(set(placeholders)), 1)
+
+    def test_bulk_update_values(self):
+        pks = [person.pk for person in self.people]
+
+        helper.bulk_update_values(
+            Person, pks, {'age': [F('age') * 2 for _ in pks]})
+
+        self.assertEqual(
+            list(Person.objects.order_by('pk').values_list('age', flat=True)),
+            [age * 2 for age in self.ages])
+
+
+class BatchUpdatedSignalTests(TestCase):
+
+    def setUp(self):
+        create_fixtures()
+        self.sent = []
+        signals.batch_updated.connect(self.receiver)
+
+    def tearDown(self):
+        signals.batch_updated.disconnect(self.receiver)
+
+    def receiver(self, **kwargs):
+        self.sent.append(kwargs)
+
+    def test_bulk_update(self):
+        people = list(Person.objects.order_by('pk'))
+        for person in people:
+            person.age += 1
+
+        Person.objects.bulk_update(
+            people, update_fields=['age', 'name'], batch_size=4)
+
+        self.assertEqual([kwargs['rows'] for kwargs in self.sent], [4, 2])
+        kwargs = self.sent[0]
+        self.assertIs(kwargs['sender'], Person)
+        self.assertEqual(kwargs['using'], 'default')
+        self.assertEqual(kwargs['strategy'], 'case')
+        self.assertEqual(kwargs['fields'], ['age', 'name'])
+        self.assertEqual(kwargs['rowcount'], 4)
+        self.assertGreater(kwargs['params'], 0)
+        self.assertGreater(kwargs['sql_bytes'], 0)
+        self.assertGreaterEqual(kwargs['prepare_time'], 0)
+        self.assertGreaterEqual(kwargs['execute_time'], 0)
+
+    def test_pipeline(self):
+        people = list(Person.objects.all())
+        Person.objects.bulk_update(
+            people, update_fields=['age'], batch_size=4, pipeline=2)
+
+        self.assertEqual(
+            sorted(kwargs['rows'] for kwargs in self.sent), [2, 4])
+
+    def test_bulk_update_values(self):
+        pks = list(Person.objects.values_list('pk', flat=True))
+
+        helper.bulk_update_values(
+            Person, pks, {'age': [1] * len(pks)}, batch_size=5)
+
+        self.assertEqual([kwargs['rowcount'] for kwargs in self.sent], [5, 1])
+        self.assertEqual(self.sent[0]['fields'], ['age'])
+
+    def test_no_receivers(self):
+        signals.batch_updated.disconnect(self.receiver)
+
+        Person.objects.bulk_update(
+            list(Person.objects.all()), update_fields=['age'])
+
+        self.assertEqual(self.sent, [])
+
+    def test_receivers_of_other_models(self):
+        signals.batch_updated.disconnect(self.receiver)
+        signals.batch_updated.connect(self.receiver, sender=PersonUUID)
+        sends = []
+        signals.batch_updated.send = lambda **kwargs: sends.append(kwargs)
+        try:
+            Person.objects.bulk_update(
+                list(Person.objects.all()), update_fields=['age'])
+        finally:
+            del signals.batch_updated.send
+            signals.batch_updated.disconnect(self.receiver, sender=PersonUUID)
+
+        # the metrics aren't even sent
+        self.assertEqual(sends, [])
+
+
+class BenchmarksTests(TestCase):
+
+    def test_run(self):
+        from benchmarks import suite
+
+        results = list(suite.run(
+            cases=['person', 'uuid'], rows=[6], widths=[1, 100],
+            batch_sizes=[None, 4], methods=['bulk_update', 'save'],
+            repeat=2))
+
+        # uuid has a single field
+        self.assertEqual(len(results), 2 * 2 * 2 + 2 * 2)
+        self.assertEqual(
+            set(result['fields'] for result in results
+                if result['case'] == 'person'),
+            set([1, len(suite.PERSON_FIELDS)]))
+        for result in results:
+            self.assertEqual(result['vendor'], connection.vendor)
+            self.assertEqual(len(result['times']), 2)
+            self.assertEqual(result['seconds'], min(result['times']))
+        self.assertFalse(Person.objects.exists())
+
+    def test_strategies(self):
+        from benchmarks import suite
+
+        results = list(suite.run(
+            cases=['uuid'], rows=[6], methods=['bulk_update', 'save'],
+            repeat=1, strategies=['case', 'values', 'join']))
+
+        self.assertEqual(
+            [(result['method'], result['strategy']) for result in results],
+            [('bulk_update', strategy)
+             for strategy in suite.available_strategies(
+                 ['case', 'values', 'join'])] + [('save', None)])
+
+    def test_regressions(self):
+        from benchmarks import suite
+
+        baseline = list(suite.run(
+            cases=['uuid'], rows=[6], methods=['bulk_update'], repeat=1))
+        results = [dict(result) for result in baseline]
+        results[0]['seconds'] = baseline[0]['seconds'] * 2
+
+        self.assertEqual(suite.regressions(results, baseline, 1.5),
+                         [(results[0], baseline[0])])
+        self.assertEqual(suite.regressions(results, baseline, 3), [])